@@ -32,8 +32,11 @@ setup(name='shuttle',
     include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
+    test_suite='shuttle.tests',
     entry_points={
         'console_scripts':
-            ['shuttle=shuttle.sync:main']
+            ['shuttle=shuttle.sync:main',
+             'shuttle-bench=shuttle.bench:main',
+             ]
     },
 )
@@ -0,0 +1,575 @@
+"""Offline benchmarks for the sync handlers.
+
+Runs each handler's push and pull against in-process fakes of the Desk
+API and the txlib HTTP handler, with synthetic catalogs and injectable
+latency, and reports wall time, remote calls and memory.
+
+Each handler runs in a child process of its own, and the memory column
+is how much that process's peak RSS grew during each direction, so one
+handler's figures don't include another's.
+"""
+
+import json
+import logging
+import multiprocessing
+import optparse
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+
+from txlib.http.exceptions import NotFoundError
+
+import metrics
+import sync
+from conf import settings
+from transifex import Tx
+
+
+LOCALE_POOL = (
+    'fr_FR', 'es_ES', 'de_DE', 'it_IT', 'ja_JP', 'pt_BR', 'nl_NL',
+    'sv_SE', 'pl_PL', 'zh_CN', 'ko_KR', 'ru_RU', 'tr_TR', 'da_DK',
+)
+ENGLISH_LOCALES = ('en_GB', 'en_AU')
+
+DESK_PAGE_SIZE = 50
+
+BENCH_SETTINGS = dict(
+    TOPICS_PROJECT_SLUG='bench-topics',
+    TUTORIALS_PROJECT_SLUG='bench-tutorials',
+    DESK_SITENAME='bench',
+    DESK_USER='bench',
+    DESK_PASSWD='bench',
+    TRANSIFEX_HOST='bench.invalid',
+    TRANSIFEX_USERNAME='bench',
+    TRANSIFEX_PASSWORD='bench',
+)
+
+
+class CallCounter(object):
+    """Thread-safe call counter which also injects latency."""
+
+    def __init__(self, latency=0):
+
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def call(self):
+
+        with self._lock:
+            self.calls += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeTxHandler(object):
+    """In-memory stand-in for the txlib HTTP handler.
+
+    Every resource is treated as fully translated into every language,
+    with the source content as its translation.
+    """
+
+    ROUTES = (
+        ('GET', r'project/(?P<project>[^/]+)/', 'get_project'),
+        ('POST', r'projects/', 'create_project'),
+        ('GET', r'project/(?P<project>[^/]+)/resources/', 'list_resources'),
+        ('POST', r'project/(?P<project>[^/]+)/resources/', 'create_resource'),
+        ('PUT', r'project/(?P<project>[^/]+)/resource/(?P<resource>[^/]+)/'
+         r'content/', 'put_content'),
+        ('PUT', r'project/(?P<project>[^/]+)/resource/(?P<resource>[^/]+)/',
+         'put_resource'),
+        ('DELETE', r'project/(?P<project>[^/]+)/resource/'
+         r'(?P<resource>[^/]+)/', 'delete_resource'),
+        ('GET', r'project/(?P<project>[^/]+)/language/(?P<lang>[^/]+)/',
+         'get_language'),
+        ('GET', r'project/(?P<project>[^/]+)/resource/(?P<resource>[^/]+)/'
+         r'stats/(?:(?P<lang>[^/]+)/)?', 'get_stats'),
+        ('GET', r'project/(?P<project>[^/]+)/resource/(?P<resource>[^/]+)/'
+         r'translation/(?P<lang>[^/]+)/', 'get_translation'),
+    )
+
+    def __init__(self, languages, latency=0):
+
+        self.languages = languages
+        self.counter = CallCounter(latency)
+        self.projects = {}
+        self._lock = threading.Lock()
+        self._routes = [
+            (method, re.compile('^%s$' % pattern), name)
+            for method, pattern, name in self.ROUTES
+        ]
+
+    def get(self, path):
+        return self._dispatch('GET', path)
+
+    def post(self, path, data, filename=None):
+        return self._dispatch('POST', path, data)
+
+    def put(self, path, data, filename=None):
+        return self._dispatch('PUT', path, data)
+
+    def delete(self, path):
+        return self._dispatch('DELETE', path)
+
+    def _dispatch(self, method, path, data=None):
+
+        self.counter.call()
+
+        path = path.split('?')[0]
+        if path.startswith('/api/2/'):
+            path = path[len('/api/2/'):]
+        path = path.rstrip('/') + '/'
+
+        for route_method, pattern, name in self._routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                if data is not None:
+                    data = json.loads(data)
+                with self._lock:
+                    return getattr(self, name)(data, **match.groupdict())
+
+        raise NotFoundError(path, http_code=404)
+
+    def _project(self, project):
+
+        if project not in self.projects:
+            raise NotFoundError(project, http_code=404)
+
+        return self.projects[project]
+
+    def _resource(self, project, resource):
+
+        resources = self._project(project)
+        if resource not in resources:
+            raise NotFoundError(resource, http_code=404)
+
+        return resources[resource]
+
+    def get_project(self, data, project):
+        self._project(project)
+        return {'slug': project}
+
+    def create_project(self, data):
+        self.projects[data['slug']] = {}
+
+    def list_resources(self, data, project):
+        return [
+            {'slug': slug, 'name': r['name'], 'i18n_type': r['i18n_type']}
+            for slug, r in self._project(project).items()
+        ]
+
+    def create_resource(self, data, project):
+        self._project(project)[data['slug']] = dict(data, revision=1)
+
+    def put_content(self, data, project, resource):
+        resource = self._resource(project, resource)
+        resource['content'] = data['content']
+        resource['revision'] += 1
+
+    def put_resource(self, data, project, resource):
+        self._resource(project, resource).update(data)
+
+    def delete_resource(self, data, project, resource):
+        self._resource(project, resource)
+        del self.projects[project][resource]
+
+    def get_language(self, data, project, lang):
+        self._project(project)
+        return {'untranslated_segments': 0}
+
+    def get_stats(self, data, project, resource, lang=None):
+        stats = {
+            'completed': '100%',
+            'last_update': str(self._resource(project, resource)['revision']),
+        }
+        if lang:
+            return stats
+        return dict((l, stats) for l in self.languages)
+
+    def get_translation(self, data, project, resource, lang):
+        return {'content': self._resource(project, resource)['content']}
+
+
+class FakeDeskObject(object):
+    """A Desk entry exposed through attribute access, like DeskObject."""
+
+    def __init__(self, desk, entry, translations=()):
+
+        self._desk = desk
+        self._entry = entry
+        self._translations = FakeTranslationCollection(desk, translations)
+
+    def __getattr__(self, key):
+
+        # like DeskObject, a missing field raises KeyError
+        return self._entry[key]
+
+    @property
+    def api_href(self):
+
+        return self._entry['api_href']
+
+    @property
+    def translations(self):
+
+        return self._translations
+
+    def update(self, **kwargs):
+
+        self._desk.counter.call()
+        self._entry.update(kwargs)
+
+        return self
+
+
+class FakeDeskCollection(object):
+
+    def __init__(self, desk, items):
+
+        self._desk = desk
+        self._items = items
+
+    def __iter__(self):
+
+        # one request per page, like deskapi's paging
+        for n in range(0, len(self._items), DESK_PAGE_SIZE):
+            self._desk.counter.call()
+            for item in self._items[n:n + DESK_PAGE_SIZE]:
+                yield item
+
+    def by_id(self, id):
+
+        self._desk.counter.call()
+        for item in self._items:
+            if str(item.id) == str(id):
+                return item
+
+        raise KeyError(id)
+
+    def create(self, **kwargs):
+
+        self._desk.counter.call()
+        item = FakeDeskObject(self._desk, dict(kwargs))
+        self._items.append(item)
+
+        return item
+
+
+class FakeTranslationCollection(object):
+
+    def __init__(self, desk, translations):
+
+        self._desk = desk
+        self._locales = dict(
+            (t['locale'], FakeDeskObject(desk, t)) for t in translations
+        )
+
+    def items(self):
+
+        return self._locales
+
+    def __contains__(self, locale):
+
+        return locale in self._locales
+
+    def __getitem__(self, locale):
+
+        return self._locales[locale]
+
+    def create(self, **kwargs):
+
+        self._desk.counter.call()
+        translation = FakeDeskObject(self._desk, dict(kwargs))
+        self._locales[kwargs['locale']] = translation
+
+        return translation
+
+
+class FakeDesk(object):
+    """In-memory stand-in for DeskApi2 with a synthetic catalog."""
+
+    def __init__(self, articles, locales, body_size, latency=0):
+
+        self.counter = CallCounter(latency)
+        # the whole catalog was last updated before the first sync
+        self.updated_at = time.time() - 1
+
+        desk_locales = [l.lower() for l in locales]
+        body = '<p>%s</p>' % ('x' * body_size,)
+
+        self.articles = []
+        for n in range(1, articles + 1):
+            translations = [
+                {'locale': l, 'outdated': True, 'subject': '', 'body': ''}
+                for l in desk_locales
+            ]
+            self.articles.append(FakeDeskObject(self, {
+                'id': n,
+                'api_href': '/api/v2/articles/%d' % (n,),
+                'subject': 'Article %d' % (n,),
+                'body': body,
+            }, translations))
+
+        self.topics = []
+        for n in range(1, max(2, articles // 20) + 1):
+            self.topics.append(FakeDeskObject(self, {
+                'id': n,
+                'api_href': '/api/v2/topics/%d' % (n,),
+                'name': 'Topic %d' % (n,),
+                'description': 'Description of topic %d' % (n,),
+                'in_support_center': True,
+                'show_in_portal': True,
+            }, [{'locale': l} for l in desk_locales]))
+
+    def collection(self, link_info):
+
+        if link_info['class'] == 'topic':
+            return FakeDeskCollection(self, self.topics)
+
+        match = re.search(r'since_updated_at=(\d+)', link_info['href'])
+        if match and int(match.group(1)) >= self.updated_at:
+            return FakeDeskCollection(self, [])
+
+        return FakeDeskCollection(self, self.articles)
+
+    def object(self, entry):
+
+        return FakeDeskObject(self, entry)
+
+
+def bench_tx_class(handler):
+    """Return a Tx subclass which talks to the fake handler."""
+
+    class BenchTx(Tx):
+
+        def setup_registry(self):
+            return handler
+
+    return BenchTx
+
+
+def run_benchmark(handler_name, options, log, shard=None):
+    """Run push and pull of handler_name; return a list of result dicts.
+
+    shard is an optional (K, N) passed as --shard. Each result includes
+    the set of (kind, slug, locale) writes the handler performed.
+    """
+
+    locales = list(LOCALE_POOL[:options.locales]) + list(ENGLISH_LOCALES)
+
+    desk = FakeDesk(options.articles, locales, options.body_size,
+                    latency=options.latency)
+    tx_handler = FakeTxHandler(locales, latency=options.latency)
+    # the topics project is maintained by hand, not created by shuttle
+    tx_handler.projects[settings.TOPICS_PROJECT_SLUG] = {}
+
+    sync_options, args = sync.parse_args(
+        ['--workers', str(options.workers), '--full']
+    )
+    sync_options.state_dir = None
+
+    if handler_name == 'topics':
+        # so is the topic strings resource, which shards which don't
+        # push it still pull; create it with an unsharded push
+        seeder = sync.DeskTopics(log, locales=locales, options=sync_options,
+                                 desk=desk)
+        seeder.tx_class = bench_tx_class(tx_handler)
+        seeder.push()
+
+    sync_options.shard = shard
+
+    handler = sync.HANDLERS[handler_name](
+        log,
+        locales=locales,
+        options=sync_options,
+        desk=desk,
+    )
+    handler.tx_class = bench_tx_class(tx_handler)
+
+    performed = set()
+    perform = handler.perform
+
+    def record(tx, operation):
+        if operation['kind'] != 'state':
+            performed.add((operation['kind'], operation['slug'],
+                           operation['locale']))
+        return perform(tx, operation)
+
+    handler.perform = record
+
+    results = []
+    for direction in ('push', 'pull'):
+        desk_calls = desk.counter.calls
+        tx_calls = tx_handler.counter.calls
+        performed.clear()
+        peak_rss = metrics.peak_rss_kb()
+
+        started = time.time()
+        getattr(handler, direction)()
+        elapsed = time.time() - started
+
+        results.append({
+            'handler': handler_name,
+            'direction': direction,
+            'seconds': elapsed,
+            'desk_calls': desk.counter.calls - desk_calls,
+            'tx_calls': tx_handler.counter.calls - tx_calls,
+            'rss_growth_kb': metrics.peak_rss_kb() - peak_rss,
+            'units': set(performed),
+        })
+
+    return results
+
+
+def _run_child(queue, handler_name, options, stats_path):
+
+    try:
+        # forked with the parent's figures, which it already has
+        metrics.registry.reset()
+        log = logging.getLogger('shuttle.bench')
+        results = run_benchmark(handler_name, options, log)
+        metrics.registry.write_json(stats_path)
+    except Exception:
+        queue.put((None, traceback.format_exc()))
+    else:
+        queue.put((results, None))
+
+
+def run_isolated(handler_name, options):
+    """Run run_benchmark in a child process; return its results.
+
+    Peak RSS can only grow within a process, so running each handler
+    in a fresh one keeps earlier handlers out of its figures. The
+    child's endpoint statistics are added to metrics.registry.
+    """
+
+    handle, stats_path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+
+    try:
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(
+            target=_run_child,
+            args=(queue, handler_name, options, stats_path),
+        )
+        child.start()
+        results, error = queue.get()
+        child.join()
+
+        if error is not None:
+            raise RuntimeError(
+                'Benchmark of %s failed:\n%s' % (handler_name, error))
+
+        metrics.registry.load_json(stats_path)
+    finally:
+        os.remove(stats_path)
+
+    return results
+
+
+def check_shards(handler_name, options, log):
+    """Run each of options.shards shards of handler_name against fakes.
+
+    Returns a dict with the number of units written by an unsharded
+    run, and those written by more than one shard, by no shard, or
+    only by shards.
+    """
+
+    full = set()
+    for result in run_benchmark(handler_name, options, log):
+        full |= result['units']
+
+    seen = set()
+    overlap = set()
+    for k in range(1, options.shards + 1):
+        units = set()
+        for result in run_benchmark(handler_name, options, log,
+                                    shard=(k, options.shards)):
+            units |= result['units']
+
+        overlap |= seen & units
+        seen |= units
+
+    return {
+        'handler': handler_name,
+        'units': len(full),
+        'overlap': len(overlap),
+        'missing': len(full - seen),
+        'extra': len(seen - full),
+    }
+
+
+def format_results(results):
+
+    lines = ['%-20s %-5s %9s %10s %10s %13s' % (
+        'handler', 'dir', 'wall(s)', 'desk', 'tx', 'peak RSS +MB',
+    )]
+    for r in results:
+        lines.append('%-20s %-5s %9.2f %10d %10d %13.1f' % (
+            r['handler'], r['direction'], r['seconds'], r['desk_calls'],
+            r['tx_calls'], r['rss_growth_kb'] / 1024.0,
+        ))
+
+    return '\n'.join(lines)
+
+
+def parse_args(args=None):
+
+    parser = optparse.OptionParser()
+    parser.add_option('-t', '--types', action='store',
+                      default='topics,tutorials,english_topics,'
+                      'english_tutorials',
+                      help='Comma delimited list of handlers to benchmark.')
+    parser.add_option('--articles', type='int', default=200,
+                      help='Number of synthetic Desk articles.')
+    parser.add_option('--locales', type='int', default=6,
+                      help='Number of non-English locales (up to %d).' % (
+                          len(LOCALE_POOL),))
+    parser.add_option('--body-size', type='int', default=4096,
+                      help='Size of each article body, in bytes.')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='Seconds of latency added to each fake call.')
+    parser.add_option('-w', '--workers', type='int', default=1,
+                      help='Value of --workers passed to the handlers.')
+    parser.add_option('--stats', action='store_true',
+                      help='Also print the per-endpoint call statistics.')
+    parser.add_option('--shards', type='int',
+                      help='Instead of timing, check that this many shards '
+                      'cover each handler without overlap.')
+
+    return parser.parse_args(args)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    log = logging.getLogger('shuttle.bench')
+
+    options, args = parse_args()
+
+    if not settings.configured:
+        settings.configure(**BENCH_SETTINGS)
+
+    if options.shards:
+        for handler_name in options.types.split(','):
+            print('%(handler)-20s %(units)6d units, %(overlap)d overlapping, '
+                  '%(missing)d missing, %(extra)d extra' %
+                  check_shards(handler_name.strip(), options, log))
+        return
+
+    results = []
+    for handler_name in options.types.split(','):
+        results.extend(run_isolated(handler_name.strip(), options))
+
+    print(format_results(results))
+
+    if options.stats:
+        print('')
+        print(metrics.registry.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""Caches of Desk content and Transifex translations.
+
+The Desk cache is run-scoped and shared between sync handlers; the
+translation cache persists between runs.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from workers import WorkerPool
+
+
+DESK_CACHE_FILENAME = 'desk-cache.json'
+TRANSLATION_CACHE_FILENAME = 'translations.db'
+
+# items fetched at once when streaming a list of ids; Desk's page size
+STREAM_PAGE_SIZE = 50
+
+
+class CachedCollection(object):
+    """A fully fetched Desk collection.
+
+    Behaves like the underlying deskapi collection for iteration,
+    indexing, by_id() and create(), but the items are fetched only once
+    and shared through the owning DeskCache.
+    """
+
+    def __init__(self, cache, object_class, collection, items):
+
+        self._cache = cache
+        self._object_class = object_class
+        self._collection = collection
+        self._items = items
+
+    def __iter__(self):
+
+        return iter(self._items)
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def __getitem__(self, n):
+
+        return self._items[n]
+
+    def by_id(self, id):
+
+        return self._cache.by_id(self._object_class, id)
+
+    def create(self, **kwargs):
+
+        return self._collection.create(**kwargs)
+
+
+class DeskCache(object):
+    """Wrap a DeskApi2 so each collection is fetched once per process.
+
+    Articles, topics and their translations are kept in memory for the
+    lifetime of the cache. If path and a positive ttl (in seconds) are
+    given, the full article and topic listings are also persisted to
+    path and reused by later runs until they are ttl seconds old.
+
+    If stream is True (and there is no ttl), stream() and
+    stream_by_ids() instead fetch articles a page at a time, and each
+    article and its translations are forgotten once the last hold() on
+    it is released, so memory stays bounded however large the catalog
+    is. Only a run which reads the articles in a single pass should
+    stream; anything read again after being forgotten is fetched again.
+    """
+
+    PERSISTED = ('articles', 'topics')
+
+    def __init__(self, desk, path=None, ttl=0, stream=False):
+
+        self.desk = desk
+        self.path = path
+        self.ttl = ttl
+        self.stream_items = stream
+
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._objects = {}
+        self._translations = {}
+        self._holds = {}
+        self._stored = self._load()
+
+    def fresh(self):
+        """Return an empty DeskCache sharing this cache's Desk client."""
+
+        return DeskCache(self.desk, path=self.path, ttl=self.ttl,
+                         stream=self.stream_items)
+
+    @property
+    def streaming(self):
+        """True if items are forgotten once released."""
+
+        return self.stream_items and not (self.path and self.ttl > 0)
+
+    def articles(self):
+
+        return self.collection({'class': 'article', 'href': 'articles'})
+
+    def stream_articles(self):
+
+        return self.stream({'class': 'article', 'href': 'articles'})
+
+    def topics(self):
+
+        return self.collection({'class': 'topic', 'href': 'topics'})
+
+    def collection(self, link_info):
+        """Return a CachedCollection for link_info, fetching it once."""
+
+        href = link_info['href']
+
+        # fetch outside the lock, as by_id() does, so listing one
+        # collection doesn't stall lookups made by other handlers; a
+        # racing duplicate fetch is harmless
+        with self._lock:
+            if href in self._collections:
+                return self._collections[href]
+
+            stored = self._stored.get(href)
+
+        collection = self.desk.collection(link_info)
+
+        if stored is not None:
+            items = [self.desk.object(e) for e in stored['entries']]
+        else:
+            with metrics.registry.timed(
+                    'desk.list_%ss' % (link_info['class'],)):
+                items = list(collection)
+
+        with self._lock:
+            if href in self._collections:
+                return self._collections[href]
+
+            if stored is None:
+                self._store(href, items)
+
+            for item in items:
+                self._objects.setdefault(item.api_href, item)
+
+            return self._collections.setdefault(href, CachedCollection(
+                self, link_info['class'], collection, items,
+            ))
+
+    def stream(self, link_info):
+        """Yield the items of the collection for link_info.
+
+        When streaming, pages are fetched as the items are consumed and
+        the collection is not kept; each item is held while it is the
+        current one. Otherwise this iterates collection(link_info).
+        """
+
+        with self._lock:
+            cached = link_info['href'] in self._collections
+
+        if cached or not self.streaming:
+            for item in self.collection(link_info):
+                yield item
+            return
+
+        for item in self._held(self._pages(link_info)):
+            yield item
+
+    def stream_by_ids(self, object_class, ids, workers=1, log=None):
+        """Yield the object_class items for ids, like by_ids().
+
+        The items are fetched STREAM_PAGE_SIZE at a time, and each is
+        held while it is the current one.
+        """
+
+        ids = list(ids)
+        for start in range(0, len(ids), STREAM_PAGE_SIZE):
+            items = self.by_ids(object_class,
+                                ids[start:start + STREAM_PAGE_SIZE],
+                                workers=workers, log=log)
+            for item in self._held(items):
+                yield item
+
+    def hold(self, obj):
+        """Keep obj and its translations cached until release(obj)."""
+
+        with self._lock:
+            self._objects.setdefault(obj.api_href, obj)
+            self._holds[obj.api_href] = self._holds.get(obj.api_href, 0) + 1
+
+    def release(self, obj):
+        """Release a hold(); the last forgets obj when streaming."""
+
+        href = obj.api_href
+
+        with self._lock:
+            holds = self._holds.pop(href, 1) - 1
+            if holds > 0:
+                self._holds[href] = holds
+            elif self.streaming:
+                self._objects.pop(href, None)
+                self._translations.pop(href, None)
+
+    def _held(self, items):
+
+        for item in items:
+            self.hold(item)
+            try:
+                yield item
+            finally:
+                self.release(item)
+
+    def _pages(self, link_info):
+        """Yield the items of a collection, fetching one page at a time.
+
+        deskapi's collections fetch every page before returning the
+        first item, so the pages are followed here.
+        """
+
+        if not hasattr(self.desk, 'request'):
+            # not a deskapi client; its collections page for themselves
+            for item in self.desk.collection(link_info):
+                yield item
+            return
+
+        path = link_info['href']
+        while path:
+            with metrics.registry.timed(
+                    'desk.list_%ss' % (link_info['class'],)):
+                page = self.desk.request(path).json()
+
+            for entry in (page.get('_embedded') or {}).get('entries') or ():
+                yield self.desk.object(entry)
+
+            path = ((page.get('_links') or {}).get('next') or {}).get('href')
+
+    def by_id(self, object_class, id):
+        """Return the object_class item with id, fetching it at most once."""
+
+        path = '%ss' % (object_class,)
+        href = '/api/v2/%s/%s' % (path, id)
+
+        # fetch outside the lock so concurrent lookups of different
+        # items don't serialize; a racing duplicate fetch is harmless
+        with self._lock:
+            if href in self._objects:
+                return self._objects[href]
+
+        with metrics.registry.timed('desk.%s_by_id' % (object_class,)):
+            item = self.desk.collection({
+                'class': object_class,
+                'href': path,
+            }).by_id(id)
+
+        with self._lock:
+            return self._objects.setdefault(href, item)
+
+    def by_ids(self, object_class, ids, workers=1, log=None):
+        """Return the object_class items for ids, in order.
+
+        Duplicate ids are fetched once, and ids not yet cached are
+        fetched concurrently on up to workers threads. Items that could
+        not be fetched are logged and left out of the result.
+        """
+
+        ids = [str(id).strip() for id in ids]
+
+        pool = WorkerPool(workers, log)
+        for id in sorted(set(ids)):
+            pool.submit(
+                'lookup of %s %s' % (object_class, id),
+                self.by_id, object_class, id,
+            )
+        pool.join()
+
+        with self._lock:
+            return [
+                self._objects['/api/v2/%ss/%s' % (object_class, id)]
+                for id in ids
+                if '/api/v2/%ss/%s' % (object_class, id) in self._objects
+            ]
+
+    def translations(self, obj):
+        """Return the translations collection of obj, fetched once."""
+
+        with self._lock:
+            if obj.api_href in self._translations:
+                return self._translations[obj.api_href]
+
+        with metrics.registry.timed('desk.list_translations'):
+            translations = obj.translations
+            translations.items()
+
+        with self._lock:
+            return self._translations.setdefault(obj.api_href, translations)
+
+    def save_translation(self, obj, locale, **fields):
+        """Update the locale translation of obj, creating it if needed."""
+
+        translations = self.translations(obj)
+
+        if locale in translations:
+            with metrics.registry.timed('desk.update_translation'):
+                return translations[locale].update(**fields)
+
+        with metrics.registry.timed('desk.create_translation'):
+            return translations.create(locale=locale, **fields)
+
+    def _load(self):
+
+        if not (self.path and self.ttl > 0 and os.path.exists(self.path)):
+            return {}
+
+        with open(self.path) as cache_file:
+            stored = json.load(cache_file)
+
+        now = time.time()
+        return dict(
+            (href, listing) for href, listing in stored.items()
+            if now - listing['fetched_at'] <= self.ttl
+        )
+
+    def _store(self, href, items):
+
+        if not (self.path and self.ttl > 0 and href in self.PERSISTED):
+            return
+
+        self._stored[href] = {
+            'fetched_at': time.time(),
+            'entries': [item._entry for item in items],
+        }
+
+        with open(self.path, 'w') as cache_file:
+            json.dump(self._stored, cache_file)
+
+
+class TranslationCache(object):
+    """On-disk cache of Transifex translations, keyed by revision.
+
+    The latest downloaded revision of each (project, resource, language)
+    is kept in a SQLite database at path, so a translation is only
+    downloaded again once its revision changes; see
+    Tx.translation_content for what a revision is made of.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                ' project_slug TEXT NOT NULL,'
+                ' slug TEXT NOT NULL,'
+                ' lang TEXT NOT NULL,'
+                ' revision TEXT NOT NULL,'
+                ' content TEXT NOT NULL,'
+                ' PRIMARY KEY (project_slug, slug, lang))'
+            )
+            self._db.commit()
+
+    def get(self, project_slug, slug, lang, revision):
+        """Return the cached content of revision, or None."""
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT content FROM translations WHERE project_slug = ?'
+                ' AND slug = ? AND lang = ? AND revision = ?',
+                (project_slug, str(slug), lang, str(revision)),
+            ).fetchone()
+
+        return row and row[0]
+
+    def set(self, project_slug, slug, lang, revision, content):
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO translations'
+                ' (project_slug, slug, lang, revision, content)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (project_slug, str(slug), lang, str(revision), content),
+            )
+            self._db.commit()
+
+    def close(self):
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,266 @@
+"""Process-wide, pooled HTTP sessions for the Desk and Transifex clients.
+
+Every request made through these sessions is rate limited per service
+and retried with backoff when the server throttles us or fails.
+"""
+
+import email.utils
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 60
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_config = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'timeout': DEFAULT_TIMEOUT,
+    'retries': DEFAULT_RETRIES,
+}
+_rate_limits = {}
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def configure(pool_size=None, timeout=None, retries=None, rate_limits=None):
+    """Set the options used for sessions created after this call.
+
+    timeout is in seconds; rate_limits is a dict of service name to
+    the maximum requests per second for that service.
+    """
+
+    if pool_size:
+        _config['pool_size'] = pool_size
+    if timeout:
+        _config['timeout'] = timeout
+    if retries is not None:
+        _config['retries'] = retries
+    if rate_limits:
+        _rate_limits.update(rate_limits)
+
+
+def get_session(name):
+    """Return the process-wide PooledSession for the service name."""
+
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = new_session(name)
+
+        return _sessions[name]
+
+
+def new_session(name, label=None, **options):
+    """Return a new PooledSession for the service name.
+
+    The session has a connection pool of its own, but shares the rate
+    limit of every other session for name. options, such as pool_size
+    or timeout, override those set with configure(). If label is
+    given, the session is included in sessions() under it, ie
+    'transifex.topics'.
+    """
+
+    session = PooledSession(name=name, **dict(_config, **options))
+    session.bucket = _bucket(name)
+
+    if label:
+        with _sessions_lock:
+            _sessions[label] = session
+
+    return session
+
+
+def _bucket(name):
+
+    with _buckets_lock:
+        if name not in _buckets and _rate_limits.get(name):
+            _buckets[name] = TokenBucket(_rate_limits[name])
+
+        return _buckets.get(name)
+
+
+def sessions():
+    """Return a dict of the sessions created so far, keyed by name."""
+
+    with _sessions_lock:
+        return dict(_sessions)
+
+
+def retry_after(response):
+    """Return the seconds to wait requested by response, or None."""
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+
+    return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allowing rate requests per second.
+
+    Up to burst requests may be made back to back; after that callers
+    of acquire() block until a token is available.
+    """
+
+    def __init__(self, rate, burst=None):
+
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class PooledSession(requests.Session):
+    """A requests Session with a bounded keep-alive pool and a timeout.
+
+    The session can be shared between worker threads; up to pool_size
+    connections per host are kept open for reuse. If rate_limit is set,
+    at most that many requests per second are sent.
+
+    Responses with a throttling or server error status are retried up
+    to retries times, waiting as long as the Retry-After header asks or
+    else with jittered exponential backoff. Server errors and connection
+    failures are only retried for idempotent methods; a 429 is always
+    retried, since the request was not processed.
+
+    Bytes transferred and retries are reported to the metrics registry,
+    against the call being timed or else against '<name>.untimed'.
+    """
+
+    def __init__(self, name='http', pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, rate_limit=None):
+
+        super(PooledSession, self).__init__()
+
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = rate_limit and TokenBucket(rate_limit)
+        self.retried = 0
+        self._stats_lock = threading.Lock()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        # translations and listings are large, repetitive documents
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def request(self, method, url, **kwargs):
+
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            if self.bucket:
+                self.bucket.acquire()
+
+            try:
+                response = super(PooledSession, self).request(
+                    method, url, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt >= self.retries:
+                    self._record(kwargs.get('data'), None, attempt)
+                    raise
+                wait = None
+            else:
+                if (response.status_code not in RETRY_STATUSES or
+                    attempt >= self.retries or
+                    not (idempotent or response.status_code == 429)
+                ):
+                    self._record(kwargs.get('data'), response, attempt)
+                    return response
+                wait = retry_after(response)
+
+            if wait is None:
+                wait = min(MAX_BACKOFF, self.backoff * 2 ** attempt)
+                wait = random.uniform(wait / 2.0, wait)
+
+            attempt += 1
+            with self._stats_lock:
+                self.retried += 1
+            time.sleep(wait)
+
+    def _record(self, data, response, retries):
+
+        num_bytes = 0
+        if isinstance(data, basestring):
+            num_bytes += len(data)
+        if response is not None:
+            num_bytes += len(response.content)
+
+        metrics.registry.add_transfer(
+            '%s.untimed' % (self.name,), num_bytes, retries,
+        )
+
+    def connection_stats(self):
+        """Return a dict with the connections opened and reused so far."""
+
+        opened = 0
+        made = 0
+
+        adapters = set(self.adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                opened += pool.num_connections
+                made += pool.num_requests
+
+        return {
+            'requests': made,
+            'opened': opened,
+            'reused': made - opened,
+            'retried': self.retried,
+        }
+
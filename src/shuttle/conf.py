@@ -0,0 +1,110 @@
+"""Settings for shuttle, read without requiring Django.
+
+Each setting (ie DESK_SITENAME) is looked up, in order, in:
+
+* the environment, as SHUTTLE_DESK_SITENAME;
+* the [shuttle] section of the config file given by --config or the
+  SHUTTLE_CONFIG environment variable, as desk_sitename;
+* Django's settings, if django is installed; it is only imported when
+  a setting is found nowhere else.
+"""
+
+import os
+import threading
+
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+
+ENV_PREFIX = 'SHUTTLE_'
+CONFIG_ENV = 'SHUTTLE_CONFIG'
+CONFIG_SECTION = 'shuttle'
+
+
+class Settings(object):
+    """Settings object which can stand in for django.conf.settings."""
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._values = {}
+        self._config = None
+        self._config_path = None
+
+    @property
+    def configured(self):
+
+        return bool(self._values) or self._config is not None
+
+    def configure(self, **values):
+        """Set values explicitly; these take precedence over all sources."""
+
+        with self._lock:
+            self._values.update(values)
+
+    def load(self, path):
+        """Read settings from the config file at path."""
+
+        config = configparser.RawConfigParser()
+        if not config.read([os.path.expanduser(path)]):
+            raise IOError('Unable to read config file %s.' % (path,))
+
+        with self._lock:
+            self._config = config
+            self._config_path = path
+
+    def get(self, name, default=None):
+        """Return setting name, or default if it is not configured."""
+
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            return default
+
+    def __getattr__(self, name):
+
+        if name.startswith('_') or not name.isupper():
+            raise AttributeError(name)
+
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+
+        value = self._lookup(name)
+
+        with self._lock:
+            return self._values.setdefault(name, value)
+
+    def _lookup(self, name):
+
+        env_name = ENV_PREFIX + name
+        if env_name in os.environ:
+            return os.environ[env_name]
+
+        if self._config is None and os.environ.get(CONFIG_ENV):
+            self.load(os.environ[CONFIG_ENV])
+
+        if (self._config is not None and
+                self._config.has_option(CONFIG_SECTION, name.lower())):
+            return self._config.get(CONFIG_SECTION, name.lower())
+
+        missing = AttributeError(
+            'Setting %s is not configured; set %s or add %s to the '
+            '[%s] section of the config file.' % (
+                name, env_name, name.lower(), CONFIG_SECTION))
+
+        try:
+            from django.conf import settings as django_settings
+        except ImportError:
+            raise missing
+
+        if not (django_settings.configured or
+                os.environ.get('DJANGO_SETTINGS_MODULE')):
+            raise missing
+
+        return getattr(django_settings, name)
+
+
+settings = Settings()
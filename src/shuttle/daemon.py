@@ -0,0 +1,266 @@
+"""Long-running mode which syncs each handler on its own schedule."""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+import state
+from workers import run_ordered
+
+
+STATUS_FILENAME = 'status.json'
+DEFAULT_INTERVAL = 900
+
+
+class Daemon(object):
+    """Run sync handlers repeatedly, each on its own interval.
+
+    handlers is a dict of name to handler, created once so the HTTP
+    sessions and Transifex registry stay warm between runs; each run
+    gets a fresh Desk cache. Every handler is scheduled on a thread of
+    its own, so a run never overlaps the previous run of the same
+    handler, and a RunLock excludes other processes sharing the state
+    directory. After each run the timings of every handler are written
+    to status_path as JSON.
+
+    dependencies is a dict of handler name to the names it must run
+    after, as for workers.run_ordered(). A handler whose dependencies
+    are also run by the daemon is not scheduled on its own: it runs
+    after each run of them, on their schedule.
+    """
+
+    def __init__(self, handlers, intervals=None,
+                 default_interval=DEFAULT_INTERVAL, push=True, pull=True,
+                 state_dir=None, status_path=None, dependencies=None,
+                 log=None):
+
+        self.handlers = handlers
+        self.log = log or logging.getLogger(__name__)
+        self.dependencies = dict(
+            (name, tuple(
+                dependency
+                for dependency in (dependencies or {}).get(name, ())
+                if dependency in handlers
+            ))
+            for name in handlers
+        )
+
+        # each scheduled handler with those which run after it
+        self.groups = {}
+        for name in handlers:
+            self.groups.setdefault(self._scheduled_with(name), []).append(name)
+
+        self.intervals = {}
+        for scheduled, names in self.groups.items():
+            for name in names:
+                if name != scheduled and name in (intervals or {}):
+                    self.log.warning('%s runs after %s; ignoring its '
+                                     'interval.', name, scheduled)
+                self.intervals[name] = (intervals or {}).get(
+                    scheduled, default_interval,
+                )
+
+        self.push = push
+        self.pull = pull
+        self.state_dir = state_dir
+        self.status_path = status_path
+
+        self.started_at = time.time()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._status_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._status = dict(
+            (name, {
+                'interval': self.intervals[name],
+                'runs': 0,
+                'running': False,
+            })
+            for name in handlers
+        )
+
+    def run_once(self, name):
+        """Run handler name once, unless it is already running.
+
+        Returns True if the handler ran without raising.
+        """
+
+        handler = self.handlers[name]
+
+        lock = state.RunLock(self.state_dir, handler.run_name)
+        if not lock.acquire():
+            self.log.warning('%s is already running; skipping this run.',
+                             handler.run_name)
+            return False
+
+        handler.desk = handler.desk.fresh()
+        handler.skipped_writes = 0
+
+        self._update(name, running=True, last_started=time.time())
+        timings = {}
+        error = None
+
+        try:
+            for direction in (state.PUSH, state.PULL):
+                if not getattr(self, direction):
+                    continue
+
+                started = time.time()
+                getattr(handler, direction)()
+                timings['%s_seconds' % (direction,)] = time.time() - started
+
+        except Exception as e:
+            self.log.exception('Error running %s.', name)
+            error = str(e)
+
+        finally:
+            lock.release()
+
+        failed = 0
+        for direction in (state.PUSH, state.PULL):
+            failed += handler.state.unit_counts(
+                handler.run_name, direction,
+            ).get(state.FAILED, 0)
+
+        with self._status_lock:
+            status = self._status[name]
+            status.update(timings)
+            status.update(
+                running=False,
+                runs=status['runs'] + 1,
+                last_finished=time.time(),
+                last_error=error,
+                failed_units=failed,
+                skipped_writes=handler.skipped_writes,
+            )
+            status['last_seconds'] = (
+                status['last_finished'] - status['last_started']
+            )
+
+        self.write_status()
+
+        return error is None
+
+    def status(self):
+        """Return a dict describing the daemon and each handler's runs."""
+
+        with self._status_lock:
+            handlers = dict(
+                (name, dict(status))
+                for name, status in self._status.items()
+            )
+
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'handlers': handlers,
+            'peak_rss_kb': metrics.peak_rss_kb(),
+            'endpoints': metrics.registry.summary(),
+        }
+
+    def write_status(self):
+
+        if not self.status_path:
+            return
+
+        status = self.status()
+
+        # write and rename, so readers never see a partial file
+        with self._write_lock:
+            temp_path = '%s.%d.tmp' % (self.status_path, os.getpid())
+            with open(temp_path, 'w') as status_file:
+                json.dump(status, status_file, indent=2, sort_keys=True)
+            os.rename(temp_path, self.status_path)
+
+    def start(self):
+        """Start scheduling every handler on its own thread."""
+
+        for name in sorted(self.groups):
+            thread = threading.Thread(
+                target=self._schedule,
+                args=(name,),
+                name='shuttle-daemon-%s' % (name,),
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop scheduling; waits for runs in progress to finish."""
+
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+        self.write_status()
+
+    def serve_forever(self):
+        """Run until interrupted with ^C."""
+
+        self.log.info('Starting daemon for %s.',
+                      ', '.join('%s every %ds' % (
+                          ' then '.join(self._ordered(name)),
+                          self.intervals[name],
+                      ) for name in sorted(self.groups)))
+        self.start()
+
+        try:
+            while not self._stopped.is_set():
+                self._stopped.wait(1)
+        except KeyboardInterrupt:
+            self.log.info('Stopping daemon.')
+
+        self.stop()
+
+    def _update(self, name, **kwargs):
+
+        with self._status_lock:
+            self._status[name].update(kwargs)
+
+        self.write_status()
+
+    def _scheduled_with(self, name):
+        """Return the name of the handler whose schedule name runs on."""
+
+        while self.dependencies[name]:
+            name = self.dependencies[name][0]
+
+        return name
+
+    def _ordered(self, name):
+        """Return the handlers scheduled with name, dependencies first."""
+
+        def depth(n):
+            return max([1 + depth(d) for d in self.dependencies[n]] or [0])
+
+        return sorted(self.groups[name], key=lambda n: (depth(n), n))
+
+    def _run_group(self, name):
+
+        names = self.groups[name]
+        if len(names) == 1:
+            self.run_once(name)
+            return
+
+        run_ordered(
+            dict((n, functools.partial(self.run_once, n)) for n in names),
+            self.dependencies,
+            self.log,
+        )
+
+    def _schedule(self, name):
+
+        while not self._stopped.is_set():
+            started = time.time()
+            self._run_group(name)
+
+            next_run = started + self.intervals[name]
+            for n in self.groups[name]:
+                self._update(n, next_run=next_run)
+
+            self._stopped.wait(max(0, next_run - time.time()))
@@ -0,0 +1,106 @@
+"""Codec for the HTML envelope used for tutorial resources in Transifex.
+
+A resource document wraps an article's subject and body:
+
+        <html>
+        <head><title>SUBJECT</title></head>
+        <body>
+        BODY
+        </body>
+
+Both directions work in a single pass over the content, and documents
+can be generated piecewise for large bodies.
+"""
+
+import re
+
+
+HEAD = '\n        <html>\n        <head><title>'
+TITLE_END = '</title></head>\n        <body>\n        '
+TAIL = '\n        </body>\n        '
+
+# tags which may not appear in a body; found with one scan
+ENVELOPE_TAGS = re.compile(r'<(?:html|body)>')
+ENVELOPE_TAG_LENGTH = len('<html>')
+DOCUMENT_START = re.compile(r'\s*<html>', re.UNICODE)
+
+
+def iter_document(title, body_chunks):
+    """Yield the pieces of the document for title and body_chunks.
+
+    body_chunks is an iterable of strings, allowing the body to be
+    streamed rather than held in memory at once.
+    """
+
+    yield HEAD
+    yield title
+    yield TITLE_END
+
+    # the end of the previous chunk, so tags split between chunks are
+    # found too
+    tail = ''
+    for chunk in body_chunks:
+        assert not ENVELOPE_TAGS.search(tail + chunk)
+        tail = (tail + chunk)[1 - ENVELOPE_TAG_LENGTH:]
+        yield chunk
+
+    yield TAIL
+
+
+def make_document(title, body):
+    """Return a single HTML document containing the title and body."""
+
+    return ''.join(iter_document(title, (body,)))
+
+
+def _strip_span(content, start, end):
+    """Return (start, end) narrowed to exclude surrounding whitespace.
+
+    Whitespace is what strip() removes, so for unicode content this
+    includes non-breaking spaces.
+    """
+
+    while start < end and content[start].isspace():
+        start += 1
+    while end > start and content[end - 1].isspace():
+        end -= 1
+
+    return start, end
+
+
+def parse_document(content):
+    """Return a dict with the subject and body keys for content.
+
+    Content which isn't a full document is returned as the body. A
+    missing </title> omits the subject; a missing </body> takes the
+    body to the end of the document.
+    """
+
+    match = DOCUMENT_START.match(content)
+    if match is None:
+        # this is not a full HTML doc, probably content w/o title, tags, etc
+        start, end = _strip_span(content, 0, len(content))
+        return dict(body=content[start:end])
+
+    result = {}
+    position = match.end()
+
+    title_start = content.find('<title>', position)
+    if title_start != -1:
+        title_end = content.find('</title>', title_start + 7)
+        if title_end != -1:
+            start, end = _strip_span(content, title_start + 7, title_end)
+            result['subject'] = content[start:end]
+            position = title_end + 8
+
+    body_start = content.find('<body>', position)
+    body_start = position if body_start == -1 else body_start + 6
+
+    body_end = content.find('</body>', body_start)
+    if body_end == -1:
+        body_end = len(content)
+
+    start, end = _strip_span(content, body_start, body_end)
+    result['body'] = content[start:end]
+
+    return result
@@ -0,0 +1,104 @@
+"""Resolution of the Desk, Transifex and shuttle spellings of locales."""
+
+import collections
+import threading
+
+
+DEFAULT_VENDOR_LOCALE_MAP = {'en_us': 'en'}
+
+
+# canonical is the shuttle/Transifex spelling (fr_FR), desk the Desk one
+Locale = collections.namedtuple(
+    'Locale', ('canonical', 'desk', 'enabled', 'english'),
+)
+
+
+def spellings(locale):
+    """Return the spellings of locale which resolve to the same Locale."""
+
+    lower = locale.lower()
+    return set([
+        locale,
+        lower,
+        lower.replace('_', '-'),
+        lower.replace('-', '_'),
+    ])
+
+
+class LocaleResolver(object):
+    """Map every spelling of a locale to its Locale, computed once.
+
+    Desk spells locales in lower case (fr_fr) and renames some through
+    the vendor locale map (en_us is en); Transifex and shuttle use
+    fr_FR. The table of every known spelling of the enabled locales and
+    the vendor map is built up front, and any other spelling is
+    resolved on first use and remembered, so each lookup is a single
+    dict access.
+    """
+
+    def __init__(self, enabled_locales=None, vendor_locale_map=None):
+
+        self.enabled_locales = tuple(enabled_locales or ())
+        self.vendor_locale_map = dict(
+            vendor_locale_map or DEFAULT_VENDOR_LOCALE_MAP
+        )
+        self._reverse_map = dict(
+            (v, k) for k, v in self.vendor_locale_map.items()
+        )
+
+        self._enabled = frozenset(
+            self._canonical(l) for l in self.enabled_locales
+        )
+
+        self._lock = threading.Lock()
+        self._table = {}
+
+        known = list(self.enabled_locales)
+        known.extend(self.vendor_locale_map.keys())
+        known.extend(self.vendor_locale_map.values())
+        for locale in known:
+            entry = self._make(locale)
+            names = (spellings(locale) | spellings(entry.canonical) |
+                     spellings(entry.desk))
+            for name in names:
+                self._table.setdefault(name, entry)
+
+    def resolve(self, locale):
+        """Return the Locale for any spelling of locale."""
+
+        try:
+            return self._table[locale]
+        except KeyError:
+            entry = self._make(locale)
+            with self._lock:
+                return self._table.setdefault(locale, entry)
+
+    def canonical(self, locale):
+        """Return the shuttle/Transifex spelling of locale, ie fr_FR."""
+
+        return self.resolve(locale).canonical
+
+    def desk(self, locale):
+        """Return the Desk spelling of locale, ie fr_fr."""
+
+        return self.resolve(locale).desk
+
+    def _canonical(self, locale):
+
+        key = locale.lower().replace('-', '_')
+        pieces = self._reverse_map.get(key, key).split('_')
+        pieces[1:] = [p.upper() for p in pieces[1:]]
+
+        return '_'.join(pieces)
+
+    def _make(self, locale):
+
+        canonical = self._canonical(locale)
+        lower = canonical.lower()
+
+        return Locale(
+            canonical=canonical,
+            desk=self.vendor_locale_map.get(lower, lower),
+            enabled=canonical in self._enabled,
+            english=lower.split('_')[0] == 'en',
+        )
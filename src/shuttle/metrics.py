@@ -0,0 +1,220 @@
+"""Per-call timing instrumentation and end-of-run performance reports."""
+
+import functools
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# latencies kept per endpoint for the percentiles; beyond this a uniform
+# sample is kept, so a long-running daemon's memory stays bounded
+MAX_SAMPLES = 1000
+
+
+def percentile(values, fraction):
+    """Return the fraction (0..1) percentile of the sorted values."""
+
+    if not values:
+        return 0.0
+
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process, in KB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in bytes rather than KB
+        peak //= 1024
+
+    return peak
+
+
+class Metrics(object):
+    """Thread-safe registry of call counts, latencies and transfer sizes.
+
+    Calls are recorded by endpoint name, such as 'tx.get_project'. While
+    a call is being timed, bytes transferred and retries reported by the
+    HTTP layer are attributed to it. Counts, totals and maximums are
+    exact; percentiles come from a sample of up to MAX_SAMPLES latencies.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._endpoints = {}
+
+    def _endpoint(self, name):
+
+        if name not in self._endpoints:
+            self._endpoints[name] = {
+                'calls': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'latencies': [],
+                'sampled': 0,
+                'bytes': 0,
+                'retries': 0,
+            }
+
+        return self._endpoints[name]
+
+    def _sample(self, endpoint, latency):
+
+        endpoint['sampled'] += 1
+
+        latencies = endpoint['latencies']
+        if len(latencies) < MAX_SAMPLES:
+            latencies.append(latency)
+        else:
+            n = random.randrange(endpoint['sampled'])
+            if n < MAX_SAMPLES:
+                latencies[n] = latency
+
+    def current(self):
+        """Return the name of the innermost call being timed, or None."""
+
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def timed(self, name):
+        """Context manager recording the duration of a call to name."""
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        stack.append(name)
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            stack.pop()
+
+            with self._lock:
+                endpoint = self._endpoint(name)
+                endpoint['calls'] += 1
+                endpoint['total'] += elapsed
+                endpoint['max'] = max(endpoint['max'], elapsed)
+                self._sample(endpoint, elapsed)
+
+    def add_transfer(self, default_name, num_bytes=0, retries=0):
+        """Attribute bytes and retries to the current call.
+
+        default_name is used when no call is being timed.
+        """
+
+        name = self.current() or default_name
+
+        with self._lock:
+            endpoint = self._endpoint(name)
+            endpoint['bytes'] += num_bytes
+            endpoint['retries'] += retries
+
+    def summary(self):
+        """Return a dict of endpoint name to its statistics."""
+
+        with self._lock:
+            endpoints = dict(
+                (name, dict(e, latencies=sorted(e['latencies'])))
+                for name, e in self._endpoints.items()
+            )
+
+        result = {}
+        for name, endpoint in endpoints.items():
+            latencies = endpoint['latencies']
+            result[name] = {
+                'calls': endpoint['calls'],
+                'total': endpoint['total'],
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'max': endpoint['max'],
+                'bytes': endpoint['bytes'],
+                'retries': endpoint['retries'],
+            }
+
+        return result
+
+    def report(self):
+        """Return the summary formatted as a text table."""
+
+        lines = ['%-36s %7s %9s %8s %8s %8s %10s %7s' % (
+            'endpoint', 'calls', 'total(s)', 'p50(ms)', 'p95(ms)',
+            'max(ms)', 'KB', 'retries',
+        )]
+
+        summary = self.summary()
+        for name in sorted(summary, key=lambda n: -summary[n]['total']):
+            s = summary[name]
+            lines.append('%-36s %7d %9.2f %8.1f %8.1f %8.1f %10.1f %7d' % (
+                name, s['calls'], s['total'], s['p50'] * 1000,
+                s['p95'] * 1000, s['max'] * 1000, s['bytes'] / 1024.0,
+                s['retries'],
+            ))
+
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """Write the summary to path, with the sampled latencies.
+
+        The latencies allow files from several runs (such as the shards
+        of a sync) to be combined with load_json().
+        """
+
+        summary = self.summary()
+        with self._lock:
+            for name, endpoint in self._endpoints.items():
+                summary[name]['latencies'] = sorted(endpoint['latencies'])
+
+        with open(path, 'w') as json_file:
+            json.dump(summary, json_file, indent=2, sort_keys=True)
+
+    def load_json(self, path):
+        """Add the calls recorded in a file written by write_json()."""
+
+        with open(path) as json_file:
+            summary = json.load(json_file)
+
+        with self._lock:
+            for name, stats in summary.items():
+                endpoint = self._endpoint(name)
+                endpoint['calls'] += stats['calls']
+                endpoint['total'] += stats['total']
+                endpoint['max'] = max(endpoint['max'], stats['max'])
+                for latency in stats.get('latencies', ()):
+                    self._sample(endpoint, latency)
+                endpoint['bytes'] += stats['bytes']
+                endpoint['retries'] += stats['retries']
+
+    def reset(self):
+
+        with self._lock:
+            self._endpoints = {}
+
+
+# the process-wide registry used by shuttle's clients and handlers
+registry = Metrics()
+
+
+def timed(name):
+    """Decorator recording each call of the function as name."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.timed(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
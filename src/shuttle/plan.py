@@ -0,0 +1,70 @@
+"""Serializable sync plans, separating the read phase from the writes."""
+
+import json
+import threading
+
+
+# kinds of operation in a plan
+RESOURCE = 'resource'           # create/update a Transifex resource
+TRANSLATION = 'translation'     # create/update a Desk translation
+STATE = 'state'                 # record hashes/cursors once writes succeed
+SKIP = 'skip'                   # informational: a unit that needs no write
+
+
+class SyncPlan(object):
+    """The list of operations a sync would perform.
+
+    Operations are plain dicts carrying everything needed to execute
+    them later without re-reading Desk or Transifex; see
+    DeskTxSync.perform() for their keys.
+    """
+
+    def __init__(self, operations=None):
+
+        self._lock = threading.Lock()
+        self._operations = list(operations or [])
+
+    def add(self, operation):
+
+        with self._lock:
+            self._operations.append(operation)
+
+    def operations(self, handler=None):
+        """Return the operations, optionally only those for handler."""
+
+        with self._lock:
+            return [
+                op for op in self._operations
+                if handler is None or op['handler'] == handler
+            ]
+
+    def handlers(self):
+        """Return the names of the handlers in the plan, in order."""
+
+        names = []
+        for op in self.operations():
+            if op['handler'] not in names:
+                names.append(op['handler'])
+
+        return names
+
+    def summary(self):
+        """Return a dict of (handler, kind, action) to operation count."""
+
+        counts = {}
+        for op in self.operations():
+            key = (op['handler'], op['kind'], op.get('action', ''))
+            counts[key] = counts.get(key, 0) + 1
+
+        return counts
+
+    def save(self, path):
+
+        with open(path, 'w') as plan_file:
+            json.dump({'operations': self.operations()}, plan_file, indent=1)
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path) as plan_file:
+            return cls(json.load(plan_file)['operations'])
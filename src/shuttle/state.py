@@ -0,0 +1,228 @@
+"""Persistent local state shared between shuttle runs."""
+
+import errno
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+STATE_FILENAME = 'state.db'
+LOCK_FILENAME = '%s.lock'
+
+PUSH = 'push'
+PULL = 'pull'
+
+# unit statuses
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def content_hash(content):
+    """Return a stable hex digest for content (unicode or bytes)."""
+
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+
+    return hashlib.sha1(content).hexdigest()
+
+
+class StateStore(object):
+    """SQLite backed store of content hashes, sync cursors and work units.
+
+    A hash is recorded per (resource slug, locale, direction) after
+    content is successfully written, so later runs can skip writing
+    identical content again. A cursor records when a named sync last
+    completed successfully. Units track the status of each (handler,
+    slug, locale, direction) in the current run, so an interrupted run
+    can be resumed. Passing a state_dir of None keeps the state in
+    memory for the current run only.
+    """
+
+    def __init__(self, state_dir=None):
+
+        if state_dir is None:
+            path = ':memory:'
+        else:
+            state_dir = os.path.expanduser(state_dir)
+            if not os.path.isdir(state_dir):
+                os.makedirs(state_dir)
+            path = os.path.join(state_dir, STATE_FILENAME)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS content_hashes ('
+                ' slug TEXT NOT NULL,'
+                ' locale TEXT NOT NULL,'
+                ' direction TEXT NOT NULL,'
+                ' digest TEXT NOT NULL,'
+                ' PRIMARY KEY (slug, locale, direction))'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS cursors ('
+                ' name TEXT PRIMARY KEY,'
+                ' value INTEGER NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS units ('
+                ' handler TEXT NOT NULL,'
+                ' slug TEXT NOT NULL,'
+                ' locale TEXT NOT NULL,'
+                ' direction TEXT NOT NULL,'
+                ' status TEXT NOT NULL,'
+                ' error TEXT,'
+                ' PRIMARY KEY (handler, slug, locale, direction))'
+            )
+            self._db.commit()
+
+    def get_hash(self, slug, locale, direction):
+        """Return the recorded hash, or None."""
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest FROM content_hashes'
+                ' WHERE slug = ? AND locale = ? AND direction = ?',
+                (str(slug), locale, direction),
+            ).fetchone()
+
+        return row and row[0]
+
+    def set_hash(self, slug, locale, direction, digest):
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO content_hashes'
+                ' (slug, locale, direction, digest) VALUES (?, ?, ?, ?)',
+                (str(slug), locale, direction, digest),
+            )
+            self._db.commit()
+
+    def unchanged(self, slug, locale, direction, content):
+        """Return True if content matches what was last recorded."""
+
+        return self.get_hash(slug, locale, direction) == content_hash(content)
+
+    def get_cursor(self, name):
+        """Return the recorded cursor (a Unix timestamp) for name, or None."""
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM cursors WHERE name = ?', (name,),
+            ).fetchone()
+
+        return row and row[0]
+
+    def set_cursor(self, name, value):
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)',
+                (name, int(value)),
+            )
+            self._db.commit()
+
+    def clear_cursor(self, name):
+
+        with self._lock:
+            self._db.execute('DELETE FROM cursors WHERE name = ?', (name,))
+            self._db.commit()
+
+    def unit_status(self, handler, slug, locale, direction):
+        """Return the status of a unit in the current run, or None."""
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status FROM units WHERE handler = ? AND slug = ?'
+                ' AND locale = ? AND direction = ?',
+                (handler, str(slug), locale, direction),
+            ).fetchone()
+
+        return row and row[0]
+
+    def set_unit_status(self, handler, slug, locale, direction, status,
+                        error=None):
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO units'
+                ' (handler, slug, locale, direction, status, error)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (handler, str(slug), locale, direction, status, error),
+            )
+            self._db.commit()
+
+    def unit_counts(self, handler, direction):
+        """Return a dict of status to the number of units with it."""
+
+        with self._lock:
+            return dict(self._db.execute(
+                'SELECT status, COUNT(*) FROM units'
+                ' WHERE handler = ? AND direction = ? GROUP BY status',
+                (handler, direction),
+            ).fetchall())
+
+    def reset_units(self, handler, direction):
+        """Forget the units of handler's direction, starting a new run."""
+
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM units WHERE handler = ? AND direction = ?',
+                (handler, direction),
+            )
+            self._db.commit()
+
+    def close(self):
+
+        with self._lock:
+            self._db.close()
+
+
+class RunLock(object):
+    """Exclusive, non-blocking lock held while a handler runs.
+
+    The lock is taken on a file in state_dir, so it also excludes other
+    shuttle processes (such as a cron run alongside the daemon) sharing
+    that directory. With no state_dir the lock always succeeds.
+    """
+
+    def __init__(self, state_dir, name):
+
+        self.path = None
+        if state_dir is not None:
+            state_dir = os.path.expanduser(state_dir)
+            if not os.path.isdir(state_dir):
+                os.makedirs(state_dir)
+            self.path = os.path.join(state_dir, LOCK_FILENAME % (name,))
+
+        self._file = None
+
+    def acquire(self):
+        """Take the lock; return False if it is already held."""
+
+        if self.path is None:
+            return True
+
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+        self._file = lock_file
+        return True
+
+    def release(self):
+
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
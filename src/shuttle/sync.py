@@ -1,66 +1,563 @@
+import functools
 import optparse
 import logging
+import os.path
+import threading
+import time
+import zlib
 from cStringIO import StringIO
 
-import babel.messages.catalog
-import babel.messages.pofile
-from deskapi.models import DeskApi2
-from django.conf import settings
-import txlib.api.statistics
-import txlib.api.translations
-from txlib.http.exceptions import NotFoundError
-
-from transifex import Tx
-
+import client
+import document
+import locales as shuttle_locales
+import metrics
+import plan
+import state
+from cache import (
+    DeskCache,
+    TranslationCache,
+    DESK_CACHE_FILENAME,
+    TRANSLATION_CACHE_FILENAME,
+)
+from conf import settings
+from workers import WorkerPool, run_ordered
 
-DEFAULT_VENDOR_LOCALE_MAP = {'en_us': 'en'}
 
 DEFAULT_SOURCE_LANGUAGE = 'en_US'
 DEFAULT_I18N_TYPE = 'HTML'
 
 
+def shard_of(key, count):
+    """Return the shard (0 to count - 1) of the string key.
+
+    The assignment is stable between processes and hosts.
+    """
+
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % count
+
+
+def desk_object_ref(obj):
+    """Return the (object class, id) of a Desk object, ie ('topic', '12')."""
+
+    collection, id = obj.api_href.rsplit('/', 2)[1:]
+    return collection[:-1], id
+
+
+def desk_field(obj, key):
+    """Return the key field of a Desk object, or None if it isn't set.
+
+    deskapi objects raise KeyError, not AttributeError, for fields
+    missing from their entry.
+    """
+
+    try:
+        return getattr(obj, key)
+    except (AttributeError, KeyError):
+        return None
+
+
 class DeskTxSync(object):
 
+    # the Tx client class; transifex.Tx unless replaced, which is
+    # imported on first use since it loads txlib
+    tx_class = None
+    handler_name = None
+
+    # whether the handler copies English content, or translates into
+    # the other locales
+    english = False
+
     def __init__(self, tx_project_slug, log, locales=None,
-                 vendor_locale_map=None, options=None):
+                 vendor_locale_map=None, options=None, desk=None):
 
         self.tx_project_slug = tx_project_slug
         self.log = log
-        self.enabled_locales = locales
-        self.lower_locales = [l.lower() for l in self.enabled_locales]
         self.options = options
-        self.vendor_locale_map = vendor_locale_map or DEFAULT_VENDOR_LOCALE_MAP
-        self.reverse_locale_map = dict(
-            ((v, k) for k, v in self.vendor_locale_map.iteritems())
-        )
 
-        self.desk = DeskApi2(
-            sitename=settings.DESK_SITENAME,
-            auth=(settings.DESK_USER, settings.DESK_PASSWD),
+        # locales may be a LocaleResolver shared with other handlers,
+        # or a list of the enabled locales
+        if not isinstance(locales, shuttle_locales.LocaleResolver):
+            locales = shuttle_locales.LocaleResolver(
+                locales, vendor_locale_map,
+            )
+        self.locales = locales
+        self.enabled_locales = locales.enabled_locales
+
+        # desk may be a DeskCache shared with other handlers, or a
+        # DeskApi2-like client which is given a cache of its own
+        if desk is None:
+            desk = make_desk(options)
+        elif not isinstance(desk, DeskCache):
+            desk = DeskCache(desk)
+        self.desk = desk
+
+        workers = getattr(self.options, 'workers', None) or 1
+        self._service_limits = {
+            'tx': threading.BoundedSemaphore(
+                getattr(self.options, 'tx_concurrency', None) or workers
+            ),
+            'desk': threading.BoundedSemaphore(
+                getattr(self.options, 'desk_concurrency', None) or workers
+            ),
+        }
+
+        self.state = state.StateStore(
+            getattr(self.options, 'state_dir', None)
         )
 
-    def _process_locale(self, locale):
-        """Return True if this locale should be processed."""
+        # (K, N) when running the Kth of N shards
+        self.shard = getattr(self.options, 'shard', None)
+        self.run_name = self.scoped(self.handler_name)
+
+        # with --tx-backend instance, this handler's Tx clients share a
+        # Transifex HTTP handler and connection pool of their own, set
+        # up by its <HANDLER>_TRANSIFEX_* settings, rather than the
+        # process-wide one in the txlib registry; the English handlers
+        # never talk to Transifex
+        self.tx_http = None
+        if (getattr(self.options, 'tx_backend', None) == 'instance' and
+                not self.english):
+            from transifex import instance_http_handler
+
+            self.tx_http = instance_http_handler(
+                self.handler_name, label='transifex.%s' % (self.run_name,),
+            )
+
+        # when set to a SyncPlan, writes are added to it instead of
+        # being performed
+        self.plan = None
+
+        # Desk translation writes skipped because nothing changed
+        self.skipped_writes = 0
+        self._skipped_lock = threading.Lock()
+
+    def make_tx(self):
+        """Return the Tx client used for this handler."""
+
+        return self.get_tx_class()(self.tx_project_slug,
+                                   http_handler=self.tx_http)
+
+    def get_tx_class(self):
+
+        if self.tx_class is None:
+            from transifex import Tx
+            return Tx
+
+        return self.tx_class
+
+    def make_pool(self):
+        """Return a WorkerPool sized by the --workers option."""
+
+        return WorkerPool(getattr(self.options, 'workers', None), self.log)
+
+    def throttle(self, service):
+        """Return the semaphore bounding concurrent calls to service.
 
-        if locale.lower().startswith('en'):
+        service is one of 'tx' or 'desk'; use the result as a context
+        manager around each remote call made from a worker.
+        """
+
+        return self._service_limits[service]
+
+    def unchanged(self, slug, locale, direction, content):
+        """Return True if content was already written and not forced."""
+
+        if getattr(self.options, 'force', False):
             return False
 
-        return (locale in self.enabled_locales or
+        if self.state.unchanged(slug, locale, direction, content):
+            self.log.debug('%s of %s for %s unchanged; skipping.',
+                           direction.capitalize(), slug, locale)
+            self.skip(slug, locale, direction, 'unchanged')
+            return True
+
+        return False
+
+    def skip(self, slug, locale, direction, reason):
+        """Note that a unit needs no write, for the plan if planning."""
+
+        if self.plan is not None:
+            self.plan.add({
+                'handler': self.handler_name,
+                'kind': plan.SKIP,
+                'slug': str(slug),
+                'locale': locale,
+                'direction': direction,
+                'reason': reason,
+            })
+
+    def content_hash(self, slug, locale, direction, content):
+        """Return the state hash entry to record once content is written."""
+
+        return [str(slug), locale, direction, state.content_hash(content)]
+
+    def write_resource(self, tx, slug, locale, name, content,
+                       i18n_type=None, project_slug=None, content_hash=None):
+        """Create or update a Transifex resource (or plan to)."""
+
+        exists = tx.resource_exists(slug, locale, project_slug=project_slug)
+
+        return self.perform(tx, {
+            'kind': plan.RESOURCE,
+            'action': 'update' if exists else 'create',
+            'slug': str(slug),
+            'locale': locale,
+            'name': name,
+            'content': content,
+            'i18n_type': i18n_type,
+            'project_slug': project_slug,
+            'hash': content_hash,
+        })
+
+    def write_translation(self, obj, locale, content_hash=None, **fields):
+        """Create or update the locale translation of a Desk object.
+
+        Only the fields which differ from the translation already in
+        Desk are sent; if none do, the write is skipped (unless
+        --force was given) and just the content hash is recorded.
+        """
+
+        object_class, id = desk_object_ref(obj)
+        translations = self.desk.translations(obj)
+        exists = locale in translations
+
+        if exists and not getattr(self.options, 'force', False):
+            current = translations[locale]
+            fields = dict(
+                (key, value) for key, value in fields.items()
+                if desk_field(current, key) != value
+            )
 
-                self.reverse_locale_map.get(locale.lower(), None)
-                in self.enabled_locales or
+            if not fields:
+                self.log.debug('Translation of %s %s for %s unchanged; '
+                               'skipping.', object_class, id, locale)
+                self.skip(id, locale, state.PULL, 'unchanged')
+                with self._skipped_lock:
+                    self.skipped_writes += 1
+
+                if content_hash:
+                    return self.write_state(content_hash=content_hash)
+                return True
+
+        return self.perform(None, {
+            'kind': plan.TRANSLATION,
+            'action': 'update' if exists else 'create',
+            'object_class': object_class,
+            'slug': id,
+            'locale': locale,
+            'fields': fields,
+            'hash': content_hash,
+        })
+
+    def write_state(self, content_hash=None, cursor=None):
+        """Record a content hash and/or a [name, value] cursor."""
+
+        return self.perform(None, {
+            'kind': plan.STATE,
+            'hash': content_hash,
+            'cursor': cursor,
+        })
+
+    def perform(self, tx, operation):
+        """Apply operation, or add it to the plan when planning."""
+
+        operation['handler'] = self.handler_name
+
+        if self.plan is not None:
+            self.plan.add(operation)
+            return True
+
+        return self.apply(tx, operation)
+
+    def apply(self, tx, operation):
+        """Perform a single planned operation; return True on success."""
+
+        kind = operation['kind']
+
+        if kind == plan.RESOURCE:
+            with self.throttle('tx'):
+                if not operation['project_slug']:
+                    # make sure the project exists in Tx
+                    tx.get_project(operation['locale'])
+
+                tx.create_or_update_resource(
+                    operation['slug'],
+                    operation['locale'],
+                    operation['name'],
+                    operation['content'],
+                    i18n_type=operation['i18n_type'],
+                    project_slug=operation['project_slug'],
+                )
+            success = True
 
-                locale in self.lower_locales or
+        elif kind == plan.TRANSLATION:
+            with self.throttle('desk'):
+                obj = self.desk.by_id(
+                    operation['object_class'], operation['slug'],
+                )
+                success = self.desk.save_translation(
+                    obj, operation['locale'], **operation['fields']
+                )
 
-                self.reverse_locale_map.get(locale.lower(), None)
-                in self.lower_locales
-        )
+        elif kind == plan.STATE:
+            if operation['cursor']:
+                self.state.set_cursor(*operation['cursor'])
+            success = True
+
+        else:
+            return True
+
+        if success and operation.get('hash'):
+            self.state.set_hash(*operation['hash'])
 
-    def desk_locale(self, locale):
-        """Return the Desk-style locale for locale."""
+        return success
 
-        locale = locale.lower().replace('-', '_')
-        return self.vendor_locale_map.get(locale, locale)
+    def apply_plan(self, operations):
+        """Perform the planned operations for this handler.
+
+        Writes run on the worker pool; state operations are applied
+        afterwards, and only if every write succeeded.
+        """
+
+        tx = None
+        if any(op['kind'] == plan.RESOURCE for op in operations):
+            tx = self.make_tx()
+
+        pool = self.make_pool()
+        finalizers = []
+
+        for operation in operations:
+            if operation['kind'] == plan.STATE:
+                finalizers.append(operation)
+            elif operation['kind'] != plan.SKIP:
+                pool.submit(
+                    '%(action)s of %(slug)s for %(locale)s' % operation,
+                    self._apply_unit, tx, operation,
+                )
+
+        failures = pool.join()
+        if failures:
+            self.log.error('Not recording sync state for %s after failures.',
+                           self.handler_name)
+            return failures
+
+        for operation in finalizers:
+            self.apply(tx, operation)
+
+        return failures
+
+    def _apply_unit(self, tx, operation):
+
+        if not self.apply(tx, operation):
+            raise RuntimeError('Desk did not accept the update.')
+
+    def scoped(self, name):
+        """Return name qualified by this run's --shard, if any.
+
+        Used for cursors, units and locks, so shards sharing a state
+        directory keep separate state.
+        """
+
+        if self.shard is None:
+            return name
+
+        return '%s.shard-%d-of-%d' % ((name,) + self.shard)
+
+    def in_shard(self, slug, locale):
+        """Return True if the unit (slug, locale) belongs to our --shard.
+
+        Units are assigned by a hash of the article (or resource) slug,
+        or of the canonical locale with --shard-by locale or when slug
+        is None, so every host assigns them the same way.
+        """
+
+        if self.shard is None:
+            return True
+
+        if slug is None or self.options.shard_by == 'locale':
+            key = self.locales.canonical(locale)
+        else:
+            key = str(slug)
+
+        return shard_of(key, self.shard[1]) == self.shard[0] - 1
+
+    def begin_units(self, direction):
+        """Start tracking the units of a push or pull; return its start time.
+
+        Unless --resume was given, units recorded by an earlier run are
+        forgotten. When resuming, the start time of the interrupted run
+        is returned, so the cursor is only advanced past it.
+        """
+
+        run = 'units.%s.%s' % (self.run_name, direction)
+        started = int(time.time())
+
+        if self.plan is not None:
+            return started
+
+        if getattr(self.options, 'resume', False):
+            previous = self.state.get_cursor(run)
+            if previous is not None:
+                counts = self.state.unit_counts(self.run_name, direction)
+                self.log.info('Resuming %s %s: %d unit(s) already done.',
+                              self.run_name, direction,
+                              counts.get(state.DONE, 0))
+                return previous
+
+        self.state.reset_units(self.run_name, direction)
+        self.state.set_cursor(run, started)
+
+        return started
+
+    def submit_unit(self, pool, direction, slug, locale, func, *args):
+        """Submit func(*args) to pool as the unit (slug, locale, direction).
+
+        With --resume, units completed by the interrupted run are
+        skipped; the status of the others is recorded as they finish.
+        Returns True if the unit was submitted.
+        """
+
+        label = '%s of %s for %s' % (direction, slug, locale)
+
+        if self.plan is not None:
+            pool.submit(label, func, *args)
+            return True
+
+        if (getattr(self.options, 'resume', False) and
+            self.state.unit_status(self.run_name, slug, locale,
+                                   direction) == state.DONE
+        ):
+            self.log.debug('%s already done; skipping.', label.capitalize())
+            return False
+
+        self.state.set_unit_status(self.run_name, slug, locale,
+                                   direction, state.PENDING)
+        pool.submit(label, self._run_unit, direction, slug, locale,
+                    func, *args)
+        return True
+
+    def submit_held_unit(self, pool, direction, slug, locale, obj, func,
+                         *args):
+        """submit_unit(), keeping obj in the Desk cache until func returns.
+
+        Units which read the cached translations of a streamed article
+        use this, so the article isn't forgotten (and its translations
+        fetched again) while its units are queued.
+        """
+
+        self.desk.hold(obj)
+
+        def run(*args):
+            try:
+                func(*args)
+            finally:
+                self.desk.release(obj)
+
+        if not self.submit_unit(pool, direction, slug, locale, run, *args):
+            self.desk.release(obj)
+
+    def _run_unit(self, direction, slug, locale, func, *args):
+
+        try:
+            func(*args)
+        except Exception as e:
+            self.state.set_unit_status(self.run_name, slug, locale,
+                                       direction, state.FAILED, str(e))
+            raise
+
+        self.state.set_unit_status(self.run_name, slug, locale,
+                                   direction, state.DONE)
+
+    def end_units(self, direction, failures):
+        """Finish tracking units; the run is complete if none failed."""
+
+        if self.plan is not None:
+            return
+
+        if failures:
+            counts = self.state.unit_counts(self.run_name, direction)
+            self.log.error('%s %s incomplete: %d unit(s) done, %d failed, '
+                           '%d pending; rerun with --resume to retry them.',
+                           self.run_name, direction,
+                           counts.get(state.DONE, 0),
+                           counts.get(state.FAILED, 0),
+                           counts.get(state.PENDING, 0))
+            return
+
+        self.state.reset_units(self.run_name, direction)
+        self.state.clear_cursor('units.%s.%s' % (self.run_name, direction))
+
+    def articles(self, cursor_name=None):
+        """Return an iterator over the Desk articles to sync.
+
+        If --resources was given, only those articles are returned.
+        Otherwise, if every locale this handler syncs has a recorded
+        cursor_name cursor and neither --full nor --force was given,
+        only articles updated since the oldest of them are fetched; a
+        locale without one, ie a newly enabled locale, needs a full scan.
+        When the Desk cache streams (see DeskCache.stream()), each
+        article is only kept while it, or a unit holding it, is being
+        processed.
+        """
+
+        if self.options.resources:
+            return self.desk.stream_by_ids(
+                'article',
+                self.options.resources.split(','),
+                workers=getattr(self.options, 'workers', None),
+                log=self.log,
+            )
+
+        since = None
+        if cursor_name and not (getattr(self.options, 'full', False) or
+                                getattr(self.options, 'force', False)):
+            cursors = [
+                self.state.get_cursor(name)
+                for name in self.cursor_names(cursor_name)
+            ]
+            if cursors and None not in cursors:
+                since = min(cursors)
+
+        if since is None:
+            return self.desk.stream_articles()
+
+        self.log.info('Fetching articles updated since %s.',
+                      time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(since)))
+
+        return self.desk.stream({
+            'class': 'article',
+            'href': 'articles/search?since_updated_at=%d' % (since,),
+        })
+
+    def cursor_names(self, cursor_name):
+        """Return the names of the cursor_name cursors, one per locale."""
+
+        return [
+            self.scoped('%s.%s' % (cursor_name,
+                                   self.locales.canonical(locale)))
+            for locale in self.enabled_locales
+            if self._process_locale(locale)
+        ]
+
+    def advance_cursor(self, cursor_name, started, failures=()):
+        """Record started as the cursor_name cursor of each locale synced.
+
+        The cursors are only advanced after a complete, successful scan:
+        runs limited by --resources or with failed units leave them as
+        they are.
+        """
+
+        if failures or self.options.resources:
+            return
+
+        for name in self.cursor_names(cursor_name):
+            self.write_state(cursor=[name, started])
+
+    def _process_locale(self, locale):
+        """Return True if this locale should be processed."""
+
+        entry = self.locales.resolve(locale)
+        return entry.enabled and entry.english == self.english
 
     def push(self):
         """Push data from Desk into Transifex."""
@@ -72,115 +569,147 @@ class DeskTxSync(object):
 
         raise NotImplemented()
 
+    def sync_unit(self, direction, slug, locale=None):
+        """Sync a single unit, such as one a webhook notified us of.
 
-class DeskEnglishTxSync(DeskTxSync):
+        locale may be None to sync every enabled locale of slug.
+        """
 
-    def __init__(self, *args, **kwargs):
+        raise NotImplementedError()
 
-        return super(DeskEnglishTxSync, self).__init__(None, *args, **kwargs)
 
-    def _process_locale(self, locale):
+class DeskEnglishTxSync(DeskTxSync):
 
-        if not locale.lower().startswith('en'):
+    english = True
 
-            return False
+    def __init__(self, *args, **kwargs):
 
-        return locale.lower() in self.lower_locales
+        return super(DeskEnglishTxSync, self).__init__(None, *args, **kwargs)
 
 
 class DeskEnglishTopics(DeskEnglishTxSync):
 
+    handler_name = 'english_topics'
+
     def push(self):
 
         self.log.info("Refusing to Push topics for English locales.")
 
     def pull(self):
 
+        self.begin_units(state.PULL)
+        pool = self.make_pool()
+
         for topic in self.desk.topics():
 
             if topic.in_support_center:
 
                 for locale in self.enabled_locales:
 
-                    if not self._process_locale(locale):
+                    if not (self._process_locale(locale) and
+                            self.in_shard(desk_object_ref(topic)[1], locale)):
                         continue
 
-                    log.info('Preparing to copy topic %s (%s) for %s' % (
-                        topic.name,
-                        topic.api_href,
-                        locale,
-                        ))
-
-                    locale_kwargs = dict(
-                        name=topic.name,
-                        description=topic.description,
-                        in_support_center=True,
+                    self.submit_unit(
+                        pool, state.PULL, desk_object_ref(topic)[1],
+                        self.locales.canonical(locale),
+                        self.copy_topic, topic, self.locales.desk(locale),
                     )
 
-                    if locale not in topic.translations:
-                        success = topic.translations.create(
-                            locale=locale,
-                            **locale_kwargs
-                        )
-                    else:
-                        success = topic.translations[locale].update(
-                            **locale_kwargs
-                        )
+        self.end_units(state.PULL, pool.join())
+
+    def copy_topic(self, topic, locale):
 
-                    if not success:
-                        log.error('Error updating topic %s (%s)' % (
-                            topic.name,
-                            topic.api_href,
-                            ))
+        self.log.info('Preparing to copy topic %s (%s) for %s' % (
+            topic.name,
+            topic.api_href,
+            locale,
+            ))
+
+        locale_kwargs = dict(
+            name=topic.name,
+            description=topic.description,
+            in_support_center=True,
+        )
+
+        success = self.write_translation(
+            topic, locale, **locale_kwargs
+        )
+
+        if not success:
+            self.log.error('Error updating topic %s (%s)' % (
+                topic.name,
+                topic.api_href,
+                ))
+            raise RuntimeError('Desk did not accept the update.')
 
 
 class DeskEnglishTutorials(DeskEnglishTxSync):
 
+    handler_name = 'english_tutorials'
+
     def push(self):
 
         self.log.info("Refusing to Push tutorials for English locales.")
 
     def pull(self):
 
-        if self.options.resources:
-            articles = [
-                self.desk.articles().by_id(r.strip())
-                for r in self.options.resources.split(',')
-            ]
-        else:
-            articles = self.desk.articles()
+        started = self.begin_units(state.PULL)
+        pool = self.make_pool()
 
-        for a in articles:
+        for a in self.articles('english_tutorials.pull'):
 
-            for translation in a.translations:
+            for translation in self.desk.translations(a).items().values():
 
                 if not self._process_locale(translation.locale):
                     self.log.debug('Skipping locale %s.', translation.locale)
                     continue
 
-                if (self.options.force or
-                    translation.out_of_date
+                if not self.in_shard(a.id, translation.locale):
+                    continue
+
+                if not (self.options.force or
+                        translation.outdated
                 ):
+                    self.skip(a.id, translation.locale, state.PULL,
+                              'up to date')
 
-                    log.info('Preparing to push %s for %s',
-                             a.id,
-                             translation.locale,
+                else:
+                    self.submit_held_unit(
+                        pool, state.PULL, a.id,
+                        self.locales.canonical(translation.locale), a,
+                        self.copy_article, a, translation.locale,
                     )
 
-                    success = translation.update(
-                        subject=a.subject,
-                        body=a.body,
-                    )
+        failures = pool.join()
+        self.end_units(state.PULL, failures)
+        self.advance_cursor('english_tutorials.pull', started, failures)
+
+    def copy_article(self, a, locale):
 
-                    if not success:
-                        log.error('Error updating %s (desk ID %s).',
-                                  translation.locales,
-                                  a.id,
-                        )
+        self.log.info('Preparing to push %s for %s',
+                 a.id,
+                 locale,
+        )
+
+        success = self.write_translation(
+            a, locale,
+            subject=a.subject,
+            body=a.body,
+        )
+
+        if not success:
+            self.log.error('Error updating %s (desk ID %s).',
+                      locale,
+                      a.id,
+            )
+            raise RuntimeError('Desk did not accept the update.')
 
 
 class DeskTopics(DeskTxSync):
 
+    handler_name = 'topics'
+
     def __init__(self, *args, **kwargs):
 
         super(DeskTopics, self).__init__(settings.TOPICS_PROJECT_SLUG,
@@ -191,7 +720,14 @@ class DeskTopics(DeskTxSync):
     def push(self):
         """Push topics to Transifex."""
 
-        tx = Tx(self.tx_project_slug)
+        if not self.in_shard(self.TOPIC_STRINGS_SLUG,
+                             DEFAULT_SOURCE_LANGUAGE):
+            return
+
+        import babel.messages.catalog
+        import babel.messages.pofile
+
+        tx = self.make_tx()
 
         # asssemble the template catalog
         template = babel.messages.catalog.Catalog()
@@ -199,90 +735,179 @@ class DeskTopics(DeskTxSync):
             if topic.show_in_portal:
                 template.add(topic.name)
 
+        # the serialized PO carries a creation date, so compare the
+        # messages themselves to decide whether anything changed
+        messages = u'\n'.join(sorted(m.id for m in template if m.id))
+        if (tx.resource_exists(self.TOPIC_STRINGS_SLUG,
+                               DEFAULT_SOURCE_LANGUAGE,
+                               project_slug=self.tx_project_slug) and
+            self.unchanged(self.TOPIC_STRINGS_SLUG, DEFAULT_SOURCE_LANGUAGE,
+                           state.PUSH, messages)
+        ):
+            return
+
         # serialize the catalog as a PO file
         template_po = StringIO()
         babel.messages.pofile.write_po(template_po, template)
 
         # upload/update the catalog resource
-        tx.create_or_update_resource(
+        self.write_resource(
+            tx,
             self.TOPIC_STRINGS_SLUG,
             DEFAULT_SOURCE_LANGUAGE,
             "Help Center Topics",
             template_po.getvalue(),
             i18n_type='PO',
             project_slug=self.tx_project_slug,
+            content_hash=self.content_hash(
+                self.TOPIC_STRINGS_SLUG, DEFAULT_SOURCE_LANGUAGE,
+                state.PUSH, messages,
+            ),
         )
 
     def pull(self):
-        """Pull topics from Transifex."""
+        """Pull topics from Transifex.
 
-        topic_stats = txlib.api.statistics.Statistics.get(
-            project_slug=self.tx_project_slug,
-            resource_slug=self.TOPIC_STRINGS_SLUG,
-        )
+        Each locale is a unit of work: its catalog is downloaded, reduced
+        to a msgid to translation map and applied to Desk right away, so
+        only the catalogs of in-flight locales are held in memory and
+        Desk writes start with the first download.
+        """
 
-        translated = {}
+        tx = self.make_tx()
+
+        with self.throttle('tx'):
+            topic_stats = tx.resource_statistics(
+                self.TOPIC_STRINGS_SLUG, None,
+                project_slug=self.tx_project_slug,
+            )
+
+        if topic_stats is None:
+            self.log.error('Resource %s not found when pulling topics.',
+                           self.TOPIC_STRINGS_SLUG)
+            return
+
+        self.begin_units(state.PULL)
+        pool = self.make_pool()
 
         # for each language
         for locale in self.enabled_locales:
 
-            if not self._process_locale(locale):
+            if not (self._process_locale(locale) and
+                    self.in_shard(None, locale)):
                 continue
 
-            locale_stats = getattr(topic_stats, locale, None)
+            locale_stats = topic_stats.get(locale)
             if locale_stats is None:
                 self.log.debug('Locale %s not present when pulling topics.' %
                                (locale,))
                 continue
 
             if locale_stats['completed'] == '100%':
-                # get the resource from Tx
-                translation = txlib.api.translations.Translation.get(
-                    project_slug=self.tx_project_slug,
-                    slug=self.TOPIC_STRINGS_SLUG,
-                    lang=locale,
+                self.submit_unit(
+                    pool, state.PULL, self.TOPIC_STRINGS_SLUG, locale,
+                    self.pull_locale, locale, tx,
                 )
 
-                translated[locale] = babel.messages.pofile.read_po(
-                    StringIO(translation.content.encode('utf-8'))
-                )
+        self.end_units(state.PULL, pool.join())
+
+    def sync_unit(self, direction, slug, locale=None):
+
+        if direction == state.PUSH:
+            # the topic strings are a single resource
+            self.push()
+
+        elif locale is None:
+            self.pull()
+
+        elif self._process_locale(locale):
+            self.pull_locale(locale)
+
+    def read_strings(self, content):
+        """Return a dict of msgid to translation for the PO content."""
+
+        import babel.messages.pofile
+
+        catalog = babel.messages.pofile.read_po(
+            StringIO(content.encode('utf-8'))
+        )
+
+        return dict((m.id, m.string) for m in catalog if m.id)
+
+    def pull_locale(self, locale, tx=None):
+        """Pull the topic translations for locale into Desk."""
+
+        tx = tx or self.make_tx()
+
+        # get the resource from Tx
+        with self.throttle('tx'):
+            translation = tx.translation_exists(
+                self.TOPIC_STRINGS_SLUG, locale,
+                project_slug=self.tx_project_slug,
+            )
+
+        if not translation:
+            raise RuntimeError('No translation of %s in %s.' % (
+                self.TOPIC_STRINGS_SLUG, locale))
+
+        content = translation['content']
+
+        if self.unchanged(self.TOPIC_STRINGS_SLUG, locale,
+                          state.PULL, content):
+            return
+
+        strings = self.read_strings(content)
 
-        # now that we've pulled everything from Tx, upload to Desk
         for topic in self.desk.topics():
 
-            for locale in translated:
+            if topic.name in strings:
 
-                if topic.name in translated[locale]:
+                self.log.debug(
+                    'Updating topic (%s) for locale (%s)' %
+                    (topic.name, locale),
+                )
 
-                    self.log.debug(
-                        'Updating topic (%s) for locale (%s)' %
-                        (topic.name, locale),
-                    )
+                if not self.write_translation(
+                    topic, self.locales.desk(locale),
+                    name=strings[topic.name],
+                ):
+                    raise RuntimeError('Desk did not accept the update '
+                                       'of topic %s.' % (topic.name,))
+            else:
 
-                    if locale in topic.translations:
-                        topic.translations[locale].update(
-                            name=translated[locale][topic.name].string,
-                        )
-                    else:
-                        topic.translations.create(
-                            locale=locale,
-                            name=translated[locale][topic.name].string,
-                        )
-                else:
+                self.log.error(
+                    'Topic name (%s) does not exist in locale (%s)' %
+                    (topic.name, locale),
+                )
 
-                    self.log.error(
-                        'Topic name (%s) does not exist in locale (%s)' %
-                        (topic['name'], locale),
-                    )
+        self.write_state(content_hash=self.content_hash(
+            self.TOPIC_STRINGS_SLUG, locale, state.PULL, content,
+        ))
 
 
 class DeskTutorials(DeskTxSync):
 
+    handler_name = 'tutorials'
+
     def __init__(self, *args, **kwargs):
 
         super(DeskTutorials, self).__init__(settings.TUTORIALS_PROJECT_SLUG,
                                             *args, **kwargs)
 
+        # downloaded translations are kept between runs in the state dir
+        self.translation_cache = None
+        state_dir = getattr(self.options, 'state_dir', None)
+        if state_dir:
+            self.translation_cache = TranslationCache(os.path.join(
+                os.path.expanduser(state_dir), TRANSLATION_CACHE_FILENAME,
+            ))
+
+    def make_tx(self):
+
+        return self.get_tx_class()(self.tx_project_slug,
+                                   translation_cache=self.translation_cache,
+                                   http_handler=self.tx_http)
+
     def make_resource_title(self, article):
         """Given a dict of Article information, return the Tx Resource name."""
 
@@ -294,68 +919,33 @@ class DeskTutorials(DeskTxSync):
     def make_resource_document(self, title, content, tags=[],):
         """Return a single HTML document containing the title and content."""
 
-        assert "<html>" not in content
-        assert "<body>" not in content
-
-        return """
-        <html>
-        <head><title>%(title)s</title></head>
-        <body>
-        %(content)s
-        </body>
-        """ % dict(
-            title=title,
-            content=content,
-        )
+        return document.make_document(title, content)
 
     def parse_resource_document(self, content):
-        """Return a dict with the keys title, content, tags for content."""
+        """Return a dict with the keys subject and body for content."""
 
-        content = content.strip()
-
-        if not content.startswith('<html>'):
-            # this is not a full HTML doc, probably content w/o title, tags, etc
-            return dict(body=content)
-
-        result = {}
-        if '<title>' in content and '</title>' in content:
-            result['subject'] = content[content.find('<title>') + 7:content.find('</title>')].strip()
-        result['body'] = content[content.find('<body>') + 6:content.find('</body>')].strip()
-
-        return result
-
-    def desk_to_our_locale(self, desk_locale):
-
-        locale = self.reverse_locale_map.get(
-            desk_locale, desk_locale,
-        )
-
-        pieces = locale.split('_')
-        pieces[1:] = [p.upper() for p in pieces[1:]]
-
-        return "_".join(pieces)
+        return document.parse_document(content)
 
     def push(self):
         """Push tutorials to Transifex."""
 
-        tx = Tx(self.tx_project_slug)
+        tx = self.make_tx()
+        started = self.begin_units(state.PUSH)
+        pool = self.make_pool()
 
-        if self.options.resources:
-            articles = [
-                self.desk.articles().by_id(r.strip())
-                for r in self.options.resources.split(',')
-            ]
-        else:
-            articles = self.desk.articles()
-
-        for a in articles:
+        for a in self.articles('tutorials.push'):
 
             self.log.debug(
                 'Inspecting Desk resource %s', a.api_href
             )
 
-            for translation in a.translations.items().values():
-                our_locale = self.desk_to_our_locale(translation.locale)
+            a_id = a.api_href.rsplit('/', 1)[1]
+
+            with self.throttle('desk'):
+                translations = self.desk.translations(a).items().values()
+
+            for translation in translations:
+                our_locale = self.locales.canonical(translation.locale)
 
                 self.log.debug('Checking locale %s', translation.locale)
 
@@ -363,38 +953,106 @@ class DeskTutorials(DeskTxSync):
                     self.log.debug('Skipping locale.')
                     continue
 
-                # make sure the project exists in Tx
-                tx.get_project(our_locale)
+                if not self.in_shard(a_id, our_locale):
+                    continue
 
-                a_id = a.api_href.rsplit('/', 1)[1]
-                if (self.options.force or
-                    not tx.resource_exists(a_id, our_locale) or
-                    translation.outdated
-                ):
-                    self.log.info('Resource %(id)s out of date in %(locale)s; updating.' %
-                             {'id': a_id,
-                              'locale': our_locale,
-                              },
-                    )
+                self.submit_unit(
+                    pool, state.PUSH, a_id, our_locale,
+                    self.push_translation, tx, a, translation,
+                )
 
-                    tx.create_or_update_resource(
-                        a_id,
-                        our_locale,
-                        self.make_resource_title(a),
-                        self.make_resource_document(a.subject, a.body),
-                    )
+        failures = pool.join()
+        self.end_units(state.PUSH, failures)
+        self.advance_cursor('tutorials.push', started, failures)
 
-    def is_complete(self, tx, lang, resource_slug):
+    def push_translation(self, tx, article, translation):
+        """Push a single Desk article translation to Transifex."""
+
+        our_locale = self.locales.canonical(translation.locale)
+        a_id = article.api_href.rsplit('/', 1)[1]
+
+        with self.throttle('tx'):
+            exists = tx.resource_exists(a_id, our_locale)
+
+        if not (self.options.force or
+                not exists or
+                translation.outdated
+        ):
+            self.skip(a_id, our_locale, state.PUSH, 'up to date')
+            return
+
+        document = self.make_resource_document(
+            article.subject, article.body,
+        )
+        if exists and self.unchanged(a_id, our_locale, state.PUSH,
+                                     document):
+            return
+
+        self.log.info('Resource %(id)s out of date in %(locale)s; updating.' %
+                 {'id': a_id,
+                  'locale': our_locale,
+                  },
+        )
+
+        self.write_resource(
+            tx,
+            a_id,
+            our_locale,
+            self.make_resource_title(article),
+            document,
+            content_hash=self.content_hash(
+                a_id, our_locale, state.PUSH, document,
+            ),
+        )
+
+    def sync_unit(self, direction, slug, locale=None):
+
+        tx = self.make_tx()
 
-        statistics = tx.resource_statistics(resource_slug, lang)
-        lang_statistics = getattr(statistics, lang, None)
+        if direction == state.PULL:
+            langs = [locale] if locale else self.enabled_locales
+            for lang in langs:
+                if self._process_locale(lang):
+                    self.pull_translation(tx, lang, slug)
+            return
+
+        with self.throttle('desk'):
+            article = self.desk.by_id('article', slug)
+            translations = self.desk.translations(article).items().values()
+
+        for translation in translations:
+            if not self._process_locale(translation.locale):
+                continue
+
+            if locale and (self.locales.canonical(translation.locale) !=
+                           self.locales.canonical(locale)):
+                continue
+
+            self.push_translation(tx, article, translation)
+
+    def is_complete(self, tx, lang, resource_slug):
 
-        return lang_statistics and lang_statistics['completed'] == '100%'
+        return tx.resource_completed(resource_slug, lang) == '100%'
 
     def pull(self):
         "Pull Tutorials from Transifex to Desk."""
 
-        tx = Tx(self.tx_project_slug)
+        from txlib.http.exceptions import NotFoundError
+
+        tx = self.make_tx()
+
+        if self.options.resources:
+            # fetch the requested articles once, up front, rather than
+            # once per locale as each translation is applied
+            self.desk.by_ids(
+                'article',
+                self.options.resources.split(','),
+                workers=getattr(self.options, 'workers', None),
+                log=self.log,
+            )
+
+        self.begin_units(state.PULL)
+        pool = self.make_pool()
 
         for lang in self.enabled_locales:
 
@@ -420,32 +1078,66 @@ class DeskTutorials(DeskTxSync):
                     if r['slug'] in pull_resources
                 ]
 
+            resources = [
+                r for r in resources if self.in_shard(r['slug'], lang)
+            ]
+            if not resources:
+                continue
+
+            # warm the statistics cache so is_complete() can usually
+            # answer without a request per resource
+            tx.project_statistics(lang)
+
             for resource in resources:
 
-                if self.is_complete(tx, lang, resource['slug']):
+                self.submit_unit(
+                    pool, state.PULL, resource['slug'], lang,
+                    self.pull_translation, tx, lang, resource['slug'],
+                )
+
+        self.end_units(state.PULL, pool.join())
 
-                    self.log.info('Pulling translation for %s in %s' % (resource['slug'], lang))
+    def pull_translation(self, tx, lang, slug):
+        """Pull a single completed Transifex translation into Desk."""
 
-                    translation = tx.translation_exists(resource['slug'], lang)
+        with self.throttle('tx'):
+            if not self.is_complete(tx, lang, slug):
+                self.skip(slug, lang, state.PULL, 'incomplete')
+                return
 
-                    desk_translation = self.parse_resource_document(translation.content)
+            self.log.info('Pulling translation for %s in %s' % (slug, lang))
 
-                    desk_article = self.desk.articles().by_id(resource['slug'])
-                    desk_translations = desk_article.translations
-                    if self.desk_locale(lang) in desk_translations:
-                        desk_translations[self.desk_locale(lang)].update(
-                            **desk_translation
-                        )
-                    else:
-                        desk_translations.create(
-                            locale=self.desk_locale(lang),
-                            **desk_translation
-                        )
+            # the hash of the source document last pushed from here
+            content = tx.translation_content(
+                slug, lang,
+                source_revision=self.state.get_hash(slug, lang, state.PUSH),
+            )
+
+        if content is None:
+            raise RuntimeError('No translation of %s in %s.' % (slug, lang))
+
+        if self.unchanged(slug, lang, state.PULL, content):
+            return
+
+        desk_translation = self.parse_resource_document(content)
+
+        with self.throttle('desk'):
+            desk_article = self.desk.by_id('article', slug)
+
+        if not self.write_translation(
+            desk_article, self.locales.desk(lang),
+            content_hash=self.content_hash(
+                slug, lang, state.PULL, content,
+            ),
+            **desk_translation
+        ):
+            raise RuntimeError('Desk did not accept the update.')
 
 
-def parse_args():
+def parse_args(args=None):
 
-    parser = optparse.OptionParser()
+    parser = optparse.OptionParser(usage='%prog [daemon|webhook] [options]\n'
+                                   '       %prog merge-stats [options] FILE...')
     parser.add_option("-t", "--types", type="choice",
                       choices=(
                           'topics',
@@ -469,10 +1161,201 @@ def parse_args():
     )
 
     parser.add_option('--force', action='store_true',
-                      help='Always push to Tx even if not out of date.',
+                      help='Always push to Tx even if not out of date; '
+                      'implies --full.',
+                      )
+
+    parser.add_option('--full', action='store_true',
+                      help='Scan every Desk article instead of only those '
+                      'updated since the last successful run.',
+                      )
+
+    parser.add_option('--shard', action='store', metavar='K/N',
+                      help='Only sync the Kth of N shards of the units '
+                      '(counting from 1), so N hosts can split the work.',
+                      )
+    parser.add_option('--shard-by', type='choice',
+                      choices=('article', 'locale'), default='article',
+                      help='Assign units to shards by article (the default) '
+                      'or by locale.',
+                      )
+
+    parser.add_option('--resume', action='store_true',
+                      help='Continue an interrupted or failed run, only '
+                      'processing the units it did not complete.',
+                      )
+
+    parser.add_option('--plan', action='store', metavar='PATH',
+                      help='Read Desk and Transifex state and save the '
+                      'writes a sync would make to PATH, without making them.',
+                      )
+    parser.add_option('--apply', action='store', metavar='PATH',
+                      help='Perform the writes in a plan saved with --plan.',
+                      )
+
+    parser.add_option('--config', action='store', metavar='PATH',
+                      help='Read settings from the [shuttle] section of this '
+                      'file rather than Django settings (also SHUTTLE_CONFIG).',
+                      )
+
+    parser.add_option('--state-dir', action='store', default='~/.shuttle',
+                      help='Directory for state kept between runs, such as '
+                      'hashes of content already synced.',
+                      )
+
+    parser.add_option('--desk-cache-ttl', type='int', default=0,
+                      help='Reuse Desk article and topic listings saved in '
+                      'the state directory for this many seconds.',
                       )
 
-    return parser.parse_args()
+    parser.add_option('--stats-json', action='store',
+                      help='Write per-endpoint call statistics to this file '
+                      'as JSON (with merge-stats, the merged statistics).',
+                      )
+
+    parser.add_option('-w', '--workers', type='int', default=1,
+                      help='Number of articles/locales to sync concurrently '
+                      '(supported for tutorials and topics).',
+                      )
+    parser.add_option('--http-pool-size', type='int',
+                      help='Keep-alive connections to hold open per host '
+                      '(defaults to the larger of 10 and --workers for each '
+                      'handler run).',
+                      )
+    parser.add_option('--http-timeout', type='int',
+                      default=client.DEFAULT_TIMEOUT,
+                      help='Seconds to wait on Desk and Transifex requests.',
+                      )
+    parser.add_option('--retries', type='int', default=client.DEFAULT_RETRIES,
+                      help='Times to retry throttled or failed requests.',
+                      )
+    parser.add_option('--desk-rate', type='float',
+                      help='Maximum Desk requests per second.',
+                      )
+    parser.add_option('--tx-rate', type='float',
+                      help='Maximum Transifex requests per second.',
+                      )
+    parser.add_option('--tx-backend', type='choice',
+                      choices=('shared', 'instance'), default='shared',
+                      help='Send Transifex requests through the process-wide '
+                      'client in the txlib registry (shared), or a client '
+                      'per handler (instance), configured by settings such '
+                      'as TUTORIALS_TRANSIFEX_HOST and '
+                      'TUTORIALS_TRANSIFEX_POOL_SIZE.',
+                      )
+    parser.add_option('--tx-concurrency', type='int',
+                      help='Maximum concurrent Transifex requests '
+                      '(defaults to --workers).',
+                      )
+    parser.add_option('--desk-concurrency', type='int',
+                      help='Maximum concurrent Desk requests '
+                      '(defaults to --workers).',
+                      )
+
+    parser.add_option('--interval', action='append', default=[],
+                      metavar='TYPE=SECONDS',
+                      help='With daemon, how often to sync a type; may be '
+                      'given once per type.',
+                      )
+    parser.add_option('--default-interval', type='int',
+                      help='With daemon, seconds between syncs of types '
+                      'without an --interval (defaults to 900).',
+                      )
+    parser.add_option('--status-file', action='store',
+                      help='With daemon, write last-run timings to this file '
+                      '(defaults to status.json in the state directory).',
+                      )
+
+    parser.add_option('--webhook-host',
+                      help='With webhook, the address to listen on '
+                      '(defaults to 127.0.0.1).',
+                      )
+    parser.add_option('--webhook-port', type='int',
+                      help='With webhook, the port to listen on '
+                      '(defaults to 8765).',
+                      )
+    parser.add_option('--debounce', type='float',
+                      help='With webhook, seconds to wait for further '
+                      'changes to a unit before syncing it (defaults to 5).',
+                      )
+    parser.add_option('--max-debounce', type='float',
+                      help='With webhook, the most seconds a unit which '
+                      'keeps changing waits before it is synced '
+                      '(defaults to 60).',
+                      )
+
+    options, args = parser.parse_args(args)
+
+    if options.config:
+        try:
+            settings.load(options.config)
+        except IOError as e:
+            parser.error(str(e))
+
+    if options.shard:
+        try:
+            k, n = [int(part) for part in options.shard.split('/')]
+        except ValueError:
+            k = n = 0
+        if not 0 < k <= n:
+            parser.error('Invalid --shard %s; expected K/N.' % (options.shard,))
+        options.shard = (k, n)
+
+    options.intervals = {}
+    for spec in options.interval:
+        name, _, seconds = spec.partition('=')
+        if name not in HANDLERS or not seconds.isdigit():
+            parser.error('Invalid --interval %s.' % (spec,))
+        options.intervals[name] = int(seconds)
+
+    return options, args
+
+
+def single_pass(options, args=()):
+    """Return True if the run reads the Desk articles only once.
+
+    That is a push or a pull (not both) by a single handler, without a
+    subcommand. Otherwise another handler or direction reads the
+    articles again from the shared DeskCache, so they must be kept.
+    """
+
+    return (not args and
+            not getattr(options, 'apply', None) and
+            options.types not in (None, 'all') and
+            bool(options.push) != bool(options.pull))
+
+
+def make_desk(options, stream=False):
+    """Return a DeskCache around a new Desk API client.
+
+    If stream is True, the cache forgets articles once processed; see
+    single_pass().
+    """
+
+    from deskapi.models import DeskApi2
+
+    path = None
+    state_dir = getattr(options, 'state_dir', None)
+    if state_dir:
+        path = os.path.join(os.path.expanduser(state_dir),
+                            DESK_CACHE_FILENAME)
+
+    session = client.get_session('desk')
+    session.auth = (settings.DESK_USER, settings.DESK_PASSWD)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+    })
+
+    return DeskCache(
+        DeskApi2(
+            sitename=settings.DESK_SITENAME,
+            session=session,
+        ),
+        path=path,
+        ttl=getattr(options, 'desk_cache_ttl', 0) or 0,
+        stream=stream,
+    )
 
 
 HANDLERS = dict(
@@ -482,17 +1365,37 @@ HANDLERS = dict(
     english_tutorials=DeskEnglishTutorials,
 )
 
+# when run together, the English copies run after their source handler
+HANDLER_DEPENDENCIES = dict(
+    english_topics=('topics',),
+    english_tutorials=('tutorials',),
+)
 
-def main():
-    log = logging.getLogger()
-    log.addHandler(logging.StreamHandler())
-    log.setLevel(logging.DEBUG)
 
-    options, args = parse_args()
+def run_handler(sync, options, log):
+    """Push and/or pull with sync, unless it is already running."""
+
+    lock = state.RunLock(options.state_dir, sync.run_name)
+    if not lock.acquire():
+        log.error('%s is already running; skipping.', sync.run_name)
+        return
+
+    try:
+        if options.push:
+            sync.push()
+
+        if options.pull:
+            sync.pull()
+    finally:
+        lock.release()
+
+    if sync.skipped_writes:
+        log.info('%s skipped %d unchanged Desk translation write(s).',
+                 sync.handler_name, sync.skipped_writes)
 
-    locales = options.locales
-    if locales:
-        locales = [l.strip() for l in locales.split(',')]
+
+def run_handlers(options, locales, desk, log):
+    """Run the handlers selected by options, or plan their writes."""
 
     sync_types = []
     if options.types == 'all':
@@ -504,6 +1407,7 @@ def main():
                     log,
                     locales=locales,
                     options=options,
+                    desk=desk,
                 )
             )
 
@@ -513,16 +1417,229 @@ def main():
                 log,
                 locales=locales,
                 options=options,
+                desk=desk,
             )
         )
 
+    sync_plan = None
+    if options.plan:
+        sync_plan = plan.SyncPlan()
+
     for sync in sync_types:
+        sync.plan = sync_plan
 
-        if options.push:
-            sync.push()
+    if len(sync_types) == 1:
+        run_handler(sync_types[0], options, log)
 
-        if options.pull:
-            sync.pull()
+    else:
+        # handlers share the HTTP sessions and Desk cache, and run
+        # concurrently apart from the ordering in HANDLER_DEPENDENCIES
+        results = run_ordered(
+            dict(
+                (sync.handler_name,
+                 functools.partial(run_handler, sync, options, log))
+                for sync in sync_types
+            ),
+            HANDLER_DEPENDENCIES,
+            log,
+        )
+
+        for name, (seconds, failed) in sorted(results.items()):
+            log.info('%s %s in %.2fs.', name,
+                     'failed' if failed else 'finished', seconds)
+
+    if sync_plan is not None:
+        sync_plan.save(options.plan)
+
+        for key, count in sorted(sync_plan.summary().items()):
+            log.info('Planned %s %s %s: %d', key[0], key[2] or '', key[1],
+                     count)
+
+
+def apply_plan(options, locales, desk, log):
+    """Perform the writes in the plan saved at options.apply."""
+
+    sync_plan = plan.SyncPlan.load(options.apply)
+
+    for name in sync_plan.handlers():
+        handler = HANDLERS[name](
+            log,
+            locales=locales,
+            options=options,
+            desk=desk,
+        )
+        handler.apply_plan(sync_plan.operations(name))
+
+
+def run_daemon(options, locales, desk, log):
+    """Sync the handlers selected by options on a schedule until ^C.
+
+    Without --push or --pull, both are run.
+    """
+
+    import daemon
+
+    if options.types == 'all':
+        names = list(HANDLERS)
+    else:
+        names = [options.types]
+
+    handlers = dict(
+        (name, HANDLERS[name](
+            log,
+            locales=locales,
+            options=options,
+            desk=desk,
+        ))
+        for name in names
+    )
+
+    status_path = options.status_file
+    if not status_path and options.state_dir:
+        status_path = os.path.join(os.path.expanduser(options.state_dir),
+                                   daemon.STATUS_FILENAME)
+
+    daemon.Daemon(
+        handlers,
+        intervals=options.intervals,
+        default_interval=options.default_interval or daemon.DEFAULT_INTERVAL,
+        push=options.push or not options.pull,
+        pull=options.pull or not options.push,
+        state_dir=options.state_dir,
+        status_path=status_path,
+        dependencies=HANDLER_DEPENDENCIES,
+        log=log,
+    ).serve_forever()
+
+
+def run_webhook(options, locales, desk, log):
+    """Sync units as Desk and Transifex notify us of changes, until ^C.
+
+    Notifications are authenticated with the WEBHOOK_TOKEN setting, or
+    the TRANSIFEX_WEBHOOK_SECRET for signed Transifex notifications.
+    """
+
+    import webhook
+
+    token = settings.get('WEBHOOK_TOKEN')
+    tx_secret = settings.get('TRANSIFEX_WEBHOOK_SECRET')
+    if not (token or tx_secret):
+        log.error('Set WEBHOOK_TOKEN or TRANSIFEX_WEBHOOK_SECRET to '
+                  'authenticate notifications.')
+        return
+
+    # notifications only name units of the non-English handlers
+    webhook_types = ('topics', 'tutorials')
+    if options.types in (None, 'all'):
+        names = list(webhook_types)
+    elif options.types in webhook_types:
+        names = [options.types]
+    else:
+        log.error('The webhook listener only syncs %s, not %s.',
+                  ' and '.join(webhook_types), options.types)
+        return
+
+    handlers = dict(
+        (name, HANDLERS[name](
+            log,
+            locales=locales,
+            options=options,
+            desk=desk,
+        ))
+        for name in names
+    )
+
+    # options not given on the command line keep the listener's defaults
+    listener_options = dict(
+        (name, value) for name, value in (
+            ('host', options.webhook_host),
+            ('port', options.webhook_port),
+            ('debounce', options.debounce),
+            ('max_wait', options.max_debounce),
+        )
+        if value is not None
+    )
+
+    webhook.WebhookListener(
+        handlers,
+        workers=options.workers,
+        token=token,
+        tx_secret=tx_secret,
+        log=log,
+        **listener_options
+    ).serve_forever()
+
+
+def merge_stats(options, paths, log):
+    """Combine the --stats-json files of several runs, such as shards."""
+
+    merged = metrics.Metrics()
+    for path in paths:
+        merged.load_json(path)
+
+    log.info('Merged call statistics of %d run(s):\n%s', len(paths),
+             merged.report())
+    if options.stats_json:
+        merged.write_json(options.stats_json)
+
+
+def main():
+    log = logging.getLogger()
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.DEBUG)
+
+    options, args = parse_args()
+
+    if args[:1] == ['merge-stats']:
+        return merge_stats(options, args[1:], log)
+
+    locales = options.locales
+    if locales:
+        locales = [l.strip() for l in locales.split(',')]
+
+    # resolve locale spellings once for every handler
+    locales = shuttle_locales.LocaleResolver(locales)
+
+    # with -t all, every handler may have --workers requests in flight
+    concurrent = options.workers
+    if options.types == 'all':
+        concurrent *= len(HANDLERS)
+
+    client.configure(
+        pool_size=options.http_pool_size or max(
+            client.DEFAULT_POOL_SIZE, concurrent,
+        ),
+        timeout=options.http_timeout,
+        retries=options.retries,
+        rate_limits={
+            'desk': options.desk_rate,
+            'transifex': options.tx_rate,
+        },
+    )
+
+    # all handlers share one Desk client and content cache
+    desk = make_desk(options, stream=single_pass(options, args))
+
+    if args[:1] == ['daemon']:
+        run_daemon(options, locales, desk, log)
+    elif args[:1] == ['webhook']:
+        run_webhook(options, locales, desk, log)
+    elif options.apply:
+        apply_plan(options, locales, desk, log)
+    else:
+        run_handlers(options, locales, desk, log)
+
+    for name, session in sorted(client.sessions().items()):
+        stats = session.connection_stats()
+        log.info('%s connections: %d opened, %d reused for %d requests '
+                 '(%d retried).',
+                 name, stats['opened'], stats['reused'], stats['requests'],
+                 stats['retried'])
+
+    log.info('Call statistics:\n%s', metrics.registry.report())
+    log.info('Peak memory: %.1f MB', metrics.peak_rss_kb() / 1024.0)
+    if options.stats_json:
+        metrics.registry.write_json(options.stats_json)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,150 @@
+import re
+import unittest
+
+from shuttle import metrics
+from shuttle.cache import DeskCache
+
+
+class FakeResponse(object):
+
+    def __init__(self, page):
+
+        self._page = page
+
+    def json(self):
+
+        return self._page
+
+
+class FakeTranslations(object):
+
+    def items(self):
+
+        return {}
+
+
+class FakeArticle(object):
+
+    def __init__(self, entry):
+
+        self.entry = entry
+        self.api_href = entry['_links']['self']['href']
+        self.translations = FakeTranslations()
+
+
+class FakeDesk(object):
+    """Serves articles a page at a time, like DeskApi2.request()."""
+
+    def __init__(self, articles, per_page=2):
+
+        self.per_page = per_page
+        self.entries = [
+            {'id': n, '_links': {'self': {
+                'href': '/api/v2/articles/%d' % (n,), 'class': 'article',
+            }}}
+            for n in range(1, articles + 1)
+        ]
+        self.requests = []
+
+    def request(self, path):
+
+        self.requests.append(path)
+
+        match = re.search(r'page=(\d+)', path)
+        page = int(match.group(1)) if match else 1
+        start = (page - 1) * self.per_page
+
+        links = {}
+        if start + self.per_page < len(self.entries):
+            links['next'] = {
+                'href': '/api/v2/articles?page=%d' % (page + 1,),
+                'class': 'page',
+            }
+
+        return FakeResponse({
+            'total_entries': len(self.entries),
+            '_links': links,
+            '_embedded': {
+                'entries': self.entries[start:start + self.per_page],
+            },
+        })
+
+    def collection(self, link_info):
+
+        return [self.object(entry) for entry in self.entries]
+
+    def object(self, entry):
+
+        return FakeArticle(entry)
+
+
+class StreamTests(unittest.TestCase):
+
+    def setUp(self):
+
+        metrics.registry.reset()
+        self.desk = FakeDesk(5)
+        self.cache = DeskCache(self.desk, stream=True)
+
+    def test_pages_fetched_as_consumed(self):
+
+        articles = self.cache.stream_articles()
+
+        self.assertEqual(next(articles).entry['id'], 1)
+        self.assertEqual(self.desk.requests, ['articles'])
+
+        self.assertEqual([a.entry['id'] for a in articles], [2, 3, 4, 5])
+        self.assertEqual(self.desk.requests, [
+            'articles',
+            '/api/v2/articles?page=2',
+            '/api/v2/articles?page=3',
+        ])
+        self.assertEqual(
+            metrics.registry.summary()['desk.list_articles']['calls'], 3,
+        )
+
+    def test_articles_forgotten_once_released(self):
+
+        articles = self.cache.stream_articles()
+
+        first = next(articles)
+        self.cache.translations(first)
+        self.assertTrue(first.api_href in self.cache._objects)
+        self.assertTrue(first.api_href in self.cache._translations)
+
+        second = next(articles)
+        self.assertFalse(first.api_href in self.cache._objects)
+        self.assertFalse(first.api_href in self.cache._translations)
+        self.assertTrue(second.api_href in self.cache._objects)
+
+        list(articles)
+        self.assertEqual(self.cache._objects, {})
+        self.assertEqual(self.cache._holds, {})
+
+    def test_extra_hold_keeps_article(self):
+
+        articles = self.cache.stream_articles()
+
+        first = next(articles)
+        # ie a unit still queued on a worker
+        self.cache.hold(first)
+        list(articles)
+
+        self.assertTrue(first.api_href in self.cache._objects)
+
+        self.cache.release(first)
+        self.assertFalse(first.api_href in self.cache._objects)
+
+    def test_not_streaming_keeps_collection(self):
+
+        cache = DeskCache(self.desk)
+
+        self.assertEqual(len(list(cache.stream_articles())), 5)
+        self.assertEqual(len(cache._objects), 5)
+        self.assertEqual(self.desk.requests, [])
+
+    def test_persisted_listing_is_not_streamed(self):
+
+        cache = DeskCache(self.desk, path='unused.json', ttl=60, stream=True)
+
+        self.assertFalse(cache.streaming)
@@ -0,0 +1,195 @@
+import BaseHTTPServer
+import threading
+import time
+import unittest
+
+from shuttle import client
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep connections open between requests, like Desk and Transifex
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+
+        server = self.server
+        server.requests.append((self.command, self.path))
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+
+        if server.responses:
+            status, headers = server.responses.pop(0)
+        else:
+            status, headers = 200, {}
+
+        body = 'status %d' % (status,)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = respond
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+class FakeTime(object):
+
+    def __init__(self, sleeps):
+
+        self.sleep = sleeps.append
+
+    def time(self):
+
+        return time.time()
+
+
+class PooledSessionTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeHandler)
+        self.server.requests = []
+        self.server.responses = []
+        self.url = 'http://127.0.0.1:%d/resource' % (
+            self.server.server_address[1],
+        )
+
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+        # record the waits between retries rather than sleeping
+        self.sleeps = []
+        client.time = FakeTime(self.sleeps)
+
+        self.session = client.PooledSession(name='test', retries=2)
+
+    def tearDown(self):
+
+        client.time = time
+
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def respond_with(self, *responses):
+
+        self.server.responses.extend(
+            r if isinstance(r, tuple) else (r, {}) for r in responses
+        )
+
+    def test_server_errors_are_retried(self):
+
+        self.respond_with(503, 503, 200)
+
+        response = self.session.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.session.retried, 2)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_last_response_returned_when_retries_exhausted(self):
+
+        self.respond_with(503, 502, 500, 200)
+
+        response = self.session.get(self.url)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retry_after_is_honored(self):
+
+        self.respond_with((429, {'Retry-After': '7'}), 200)
+
+        response = self.session.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sleeps, [7])
+
+    def test_backoff_without_retry_after(self):
+
+        self.session.backoff = 1
+        self.respond_with(503, 503, 200)
+
+        self.session.get(self.url)
+
+        self.assertTrue(0.5 <= self.sleeps[0] <= 1)
+        self.assertTrue(1 <= self.sleeps[1] <= 2)
+
+    def test_post_not_retried_on_server_error(self):
+
+        self.respond_with(503, 200)
+
+        response = self.session.post(self.url, data='{}')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_retried_on_429(self):
+
+        self.respond_with((429, {'Retry-After': '0'}), 200)
+
+        response = self.session.post(self.url, data='{}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests,
+                         [('POST', '/resource'), ('POST', '/resource')])
+
+    def test_put_retried_on_server_error(self):
+
+        self.respond_with(502, 200)
+
+        response = self.session.put(self.url, data='{}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_connections_are_reused(self):
+
+        for n in range(5):
+            self.session.get(self.url)
+
+        stats = self.session.connection_stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['reused'], 4)
+
+
+class RetryAfterTests(unittest.TestCase):
+
+    def response(self, value):
+
+        response = client.requests.Response()
+        if value is not None:
+            response.headers['Retry-After'] = value
+
+        return response
+
+    def test_seconds(self):
+
+        self.assertEqual(client.retry_after(self.response('12')), 12)
+
+    def test_http_date(self):
+
+        value = time.strftime('%a, %d %b %Y %H:%M:%S GMT',
+                              time.gmtime(time.time() + 30))
+
+        self.assertTrue(
+            25 <= client.retry_after(self.response(value)) <= 30
+        )
+
+    def test_missing_or_invalid(self):
+
+        self.assertEqual(client.retry_after(self.response(None)), None)
+        self.assertEqual(client.retry_after(self.response('soon')), None)
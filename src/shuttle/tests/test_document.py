@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from shuttle import document
+
+
+class MakeDocumentTests(unittest.TestCase):
+
+    def test_envelope(self):
+
+        self.assertEqual(
+            document.make_document('Title', '<p>Body</p>'),
+            '\n        <html>\n        <head><title>Title</title></head>'
+            '\n        <body>\n        <p>Body</p>\n        </body>'
+            '\n        ',
+        )
+
+    def test_iter_document_matches_make_document(self):
+
+        self.assertEqual(
+            ''.join(document.iter_document('T', ['<p>a', 'b</p>'])),
+            document.make_document('T', '<p>ab</p>'),
+        )
+
+    def test_envelope_tags_not_allowed_in_body(self):
+
+        for body in ('<html>', 'a<body>b'):
+            with self.assertRaises(AssertionError):
+                document.make_document('T', body)
+
+    def test_tags_split_between_chunks_not_allowed(self):
+
+        for chunks in (['a<bo', 'dy>b'], ['<', 'h', 'tml>'], ['x<htm', 'l>']):
+            with self.assertRaises(AssertionError):
+                list(document.iter_document('T', chunks))
+
+    def test_tags_in_title_allowed(self):
+
+        document.make_document('<b>T</b>', '<p>b</p>')
+
+
+class ParseDocumentTests(unittest.TestCase):
+
+    def assertRoundTrip(self, title, body):
+
+        self.assertEqual(
+            document.parse_document(document.make_document(title, body)),
+            {'subject': title.strip(), 'body': body.strip()},
+        )
+
+    def test_round_trip(self):
+
+        self.assertRoundTrip('Title', '<p>Body</p>')
+        self.assertRoundTrip('', '')
+        self.assertRoundTrip('  Padded  ', '\n  <table>x</table>\n  ')
+
+    def test_round_trip_unicode(self):
+
+        self.assertRoundTrip(u'H\xe9llo 世界', u'<p>\xdcml\xe4ut</p>')
+
+    def test_round_trip_large_body(self):
+
+        self.assertRoundTrip(u'T', u'<p>%s</p>' % (u'x' * 100000,))
+
+    def test_unicode_whitespace_stripped(self):
+
+        content = document.make_document(u'\xa0T\xa0', u'\xa0<p>x</p>\xa0')
+
+        self.assertEqual(
+            document.parse_document(content),
+            {'subject': u'T', 'body': u'<p>x</p>'},
+        )
+        self.assertEqual(
+            document.parse_document(u'\xa0<p>x</p>\xa0'),
+            {'body': u'<p>x</p>'},
+        )
+
+    def test_not_a_document(self):
+
+        self.assertEqual(
+            document.parse_document('  <p>Just a body</p>\n'),
+            {'body': '<p>Just a body</p>'},
+        )
+
+    def test_leading_whitespace_before_html(self):
+
+        self.assertEqual(
+            document.parse_document(u'\n \xa0<html><body> b </body>'),
+            {'body': u'b'},
+        )
+
+    def test_missing_title_end(self):
+
+        self.assertEqual(
+            document.parse_document(
+                '<html><head><title>x</head><body> b </body>'
+            ),
+            {'body': 'b'},
+        )
+
+    def test_missing_body_end(self):
+
+        self.assertEqual(
+            document.parse_document(
+                '<html><head><title> T </title></head><body> b  \n'
+            ),
+            {'subject': 'T', 'body': 'b'},
+        )
+
+    def test_missing_body_start(self):
+
+        self.assertEqual(
+            document.parse_document('<html><title>T</title> b </body>'),
+            {'subject': 'T', 'body': 'b'},
+        )
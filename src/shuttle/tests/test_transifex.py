@@ -0,0 +1,115 @@
+import unittest
+
+from shuttle import client
+from shuttle import transifex
+from shuttle.cache import TranslationCache
+from shuttle.conf import settings
+from shuttle.transifex import Tx
+
+
+class FakeHttp(object):
+
+    def __init__(self):
+
+        self.last_update = '2016-01-01 00:00:00'
+        self.content = '<p>Bonjour</p>'
+        self.downloads = 0
+
+    def get(self, path):
+
+        if '/stats/' in path:
+            return {'completed': '100%', 'last_update': self.last_update}
+
+        self.downloads += 1
+        return {'content': self.content}
+
+
+class TranslationContentTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.http = FakeHttp()
+        self.cache = TranslationCache(':memory:')
+
+    def tearDown(self):
+
+        self.cache.close()
+
+    def content(self, source_revision):
+
+        # a new Tx per run, so the statistics are fetched again
+        tx = Tx('tutorials', translation_cache=self.cache,
+                http_handler=self.http)
+        return tx.translation_content('12', 'fr', source_revision)
+
+    def test_unchanged_revision_is_cached(self):
+
+        self.assertEqual(self.content('abc'), '<p>Bonjour</p>')
+        self.assertEqual(self.content('abc'), '<p>Bonjour</p>')
+
+        self.assertEqual(self.http.downloads, 1)
+
+    def test_translation_update_downloads(self):
+
+        self.content('abc')
+        self.http.last_update = '2016-01-02 00:00:00'
+        self.http.content = '<p>Salut</p>'
+
+        self.assertEqual(self.content('abc'), '<p>Salut</p>')
+        self.assertEqual(self.http.downloads, 2)
+
+    def test_source_change_downloads(self):
+
+        self.content('abc')
+        # eg new markup around the same strings
+        self.http.content = '<div>Bonjour</div>'
+
+        self.assertEqual(self.content('def'), '<div>Bonjour</div>')
+        self.assertEqual(self.http.downloads, 2)
+
+    def test_unknown_source_is_not_cached(self):
+
+        self.content(None)
+        self.content(None)
+
+        self.assertEqual(self.http.downloads, 2)
+
+
+class InstanceHttpHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+
+        settings.configure(
+            TRANSIFEX_HOST='https://www.transifex.com',
+            TRANSIFEX_USERNAME='shuttle',
+            TRANSIFEX_PASSWORD='secret',
+            TUTORIALS_TRANSIFEX_HOST='https://tx.example.com',
+            TUTORIALS_TRANSIFEX_PASSWORD='other',
+            TUTORIALS_TRANSIFEX_POOL_SIZE='3',
+            TUTORIALS_TRANSIFEX_TIMEOUT='2.5',
+        )
+
+    def test_prefixed_settings(self):
+
+        http = transifex.instance_http_handler('tutorials',
+                                               label='transifex.test')
+
+        self.assertTrue(http._construct_full_url('/api/2/projects/')
+                        .startswith('https://tx.example.com/'))
+        self.assertEqual(http._auth_info._username, 'shuttle')
+        self.assertEqual(http._auth_info._password, 'other')
+        self.assertEqual(http._session.timeout, 2.5)
+        self.assertEqual(
+            http._session.get_adapter('https://tx.example.com/')
+            ._pool_maxsize, 3,
+        )
+        self.assertTrue(client.sessions()['transifex.test'] is http._session)
+
+    def test_defaults(self):
+
+        http = transifex.instance_http_handler('topics')
+
+        self.assertTrue(http._construct_full_url('/api/2/projects/')
+                        .startswith('https://www.transifex.com/'))
+        self.assertEqual(http._auth_info._password, 'secret')
+        self.assertEqual(http._session.timeout, client.DEFAULT_TIMEOUT)
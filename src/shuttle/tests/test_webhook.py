@@ -0,0 +1,280 @@
+import base64
+import hashlib
+import hmac
+import httplib
+import json
+import threading
+import time
+import unittest
+
+from shuttle import state
+from shuttle import webhook
+from shuttle.conf import settings
+
+
+settings.configure(
+    TOPICS_PROJECT_SLUG='topics',
+    TUTORIALS_PROJECT_SLUG='tutorials',
+)
+
+TOKEN = 'sekrit'
+TX_SECRET = 'tx-sekrit'
+
+
+class FakeClock(object):
+
+    def __init__(self):
+
+        self.now = 0.0
+
+    def time(self):
+
+        return self.now
+
+
+class DebouncerTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = FakeClock()
+        webhook.time = self.clock
+
+        self.debouncer = webhook.Debouncer(5, dispatch=None, max_wait=12)
+
+    def tearDown(self):
+
+        webhook.time = time
+
+    def add_at(self, when, key):
+
+        self.clock.now = when
+        self.debouncer.add(key)
+
+    def test_repeated_events_are_coalesced(self):
+
+        self.add_at(0, 'a')
+        self.add_at(3, 'a')
+        self.add_at(4, 'b')
+
+        self.assertEqual(self.debouncer.pending(), 2)
+        self.assertEqual(self.debouncer.take_due(now=6), [])
+        self.assertEqual(self.debouncer.take_due(now=8), ['a'])
+        self.assertEqual(self.debouncer.take_due(now=9), ['b'])
+        self.assertEqual(self.debouncer.pending(), 0)
+
+    def test_max_wait_caps_the_delay(self):
+
+        for when in (0, 4, 8, 11):
+            self.add_at(when, 'a')
+
+        # the last event would put it off until 16
+        self.assertEqual(self.debouncer.take_due(now=11.5), [])
+        self.assertEqual(self.debouncer.take_due(now=12), ['a'])
+
+    def test_max_wait_restarts_after_dispatch(self):
+
+        self.add_at(0, 'a')
+        self.assertEqual(self.debouncer.take_due(now=5), ['a'])
+
+        self.add_at(20, 'a')
+        self.assertEqual(self.debouncer.take_due(now=24), [])
+        self.assertEqual(self.debouncer.take_due(now=25), ['a'])
+
+
+class PayloadTests(unittest.TestCase):
+
+    def test_desk_article(self):
+
+        self.assertEqual(
+            webhook.desk_units({'type': 'article', 'id': 12, 'locale': 'fr'}),
+            [('tutorials', state.PUSH, '12', 'fr')],
+        )
+
+    def test_desk_article_without_locale(self):
+
+        self.assertEqual(
+            webhook.desk_units({'type': 'article', 'id': 12}),
+            [('tutorials', state.PUSH, '12', None)],
+        )
+
+    def test_desk_topic(self):
+
+        self.assertEqual(
+            webhook.desk_units({'type': 'topic', 'id': 3}),
+            [('topics', state.PUSH, webhook.TOPIC_STRINGS_SLUG, None)],
+        )
+
+    def test_desk_unknown_type(self):
+
+        self.assertRaises(ValueError, webhook.desk_units, {'type': 'case'})
+
+    def test_transifex_topics(self):
+
+        self.assertEqual(
+            webhook.transifex_units({
+                'project': 'topics', 'resource': 'desk-topics',
+                'language': 'fr', 'percent': '100',
+            }),
+            [('topics', state.PULL, 'desk-topics', 'fr')],
+        )
+
+    def test_transifex_tutorials(self):
+
+        self.assertEqual(
+            webhook.transifex_units({
+                'project': 'tutorials-fr', 'resource': '12',
+                'language': 'fr',
+            }),
+            [('tutorials', state.PULL, '12', 'fr')],
+        )
+
+    def test_transifex_partial_translation(self):
+
+        self.assertEqual(
+            webhook.transifex_units({
+                'project': 'tutorials-fr', 'resource': '12',
+                'language': 'fr', 'percent': '80',
+            }),
+            [],
+        )
+
+    def test_transifex_unknown_project(self):
+
+        self.assertRaises(ValueError, webhook.transifex_units, {
+            'project': 'other', 'resource': '12', 'language': 'fr',
+        })
+
+
+class ListenerTests(unittest.TestCase):
+
+    def setUp(self):
+
+        # notifications are queued but never dispatched, as the
+        # debouncer isn't started
+        self.listener = webhook.WebhookListener(
+            {'topics': None, 'tutorials': None},
+            port=0, token=TOKEN, tx_secret=TX_SECRET,
+        )
+        self.thread = threading.Thread(
+            target=self.listener.server.serve_forever, args=(0.05,),
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+
+        self.listener.server.shutdown()
+        self.listener.server.server_close()
+
+    def post(self, path, body, headers=None):
+
+        connection = httplib.HTTPConnection(
+            *self.listener.server.server_address)
+        try:
+            connection.request('POST', path, body, headers or {})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def signed(self, body, secret=TX_SECRET):
+
+        return {'X-TX-Signature': base64.b64encode(
+            hmac.new(secret, body, hashlib.sha1).digest())}
+
+    def test_token_is_required(self):
+
+        self.assertRaises(ValueError, webhook.WebhookListener, {}, port=0)
+
+    def test_missing_token(self):
+
+        body = json.dumps({'type': 'article', 'id': 12})
+
+        self.assertEqual(self.post('/desk', body)[0], 403)
+        self.assertEqual(self.listener.debouncer.pending(), 0)
+
+    def test_bad_token(self):
+
+        body = json.dumps({'type': 'article', 'id': 12})
+
+        self.assertEqual(
+            self.post('/desk', body, {webhook.TOKEN_HEADER: 'wrong'})[0],
+            403,
+        )
+        self.assertEqual(self.post('/desk?token=wrong', body)[0], 403)
+
+    def test_token_header(self):
+
+        body = json.dumps({'type': 'article', 'id': 12})
+
+        self.assertEqual(
+            self.post('/desk', body, {webhook.TOKEN_HEADER: TOKEN}),
+            (202, {'units': 1}),
+        )
+        self.assertEqual(self.listener.debouncer.pending(), 1)
+
+    def test_token_query(self):
+
+        body = json.dumps({'type': 'topic', 'id': 3})
+
+        self.assertEqual(self.post('/desk?token=%s' % (TOKEN,), body),
+                         (202, {'units': 1}))
+
+    def test_transifex_signature(self):
+
+        body = 'project=tutorials-fr&resource=12&language=fr'
+        headers = self.signed(body)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        self.assertEqual(self.post('/transifex', body, headers),
+                         (202, {'units': 1}))
+
+    def test_bad_transifex_signature(self):
+
+        body = json.dumps({'project': 'tutorials-fr', 'resource': '12',
+                           'language': 'fr'})
+
+        self.assertEqual(
+            self.post('/transifex', body, self.signed(body, 'wrong'))[0],
+            403,
+        )
+        self.assertEqual(self.listener.debouncer.pending(), 0)
+
+    def test_signature_does_not_authorize_desk(self):
+
+        body = json.dumps({'type': 'article', 'id': 12})
+
+        self.assertEqual(self.post('/desk', body, self.signed(body))[0], 403)
+
+    def test_malformed_json(self):
+
+        headers = {webhook.TOKEN_HEADER: TOKEN}
+
+        self.assertEqual(self.post('/desk', '{"type": ', headers)[0], 400)
+
+    def test_missing_fields(self):
+
+        headers = {webhook.TOKEN_HEADER: TOKEN}
+
+        self.assertEqual(
+            self.post('/desk', json.dumps({'type': 'article'}), headers)[0],
+            400,
+        )
+        self.assertEqual(
+            self.post('/transifex', json.dumps({'project': 'topics'}),
+                      headers)[0],
+            400,
+        )
+        self.assertEqual(
+            self.post('/desk', json.dumps(['article']), headers)[0],
+            400,
+        )
+        self.assertEqual(self.listener.debouncer.pending(), 0)
+
+    def test_repeated_notifications_are_one_unit(self):
+
+        body = json.dumps({'type': 'article', 'id': 12, 'locale': 'fr'})
+        for n in range(3):
+            self.post('/desk', body, {webhook.TOKEN_HEADER: TOKEN})
+
+        self.assertEqual(self.listener.debouncer.pending(), 1)
@@ -1,14 +1,13 @@
-from django.conf import settings
+import json
+import threading
+
 from txlib import registry
-from txlib.http import auth
-from txlib.http.exceptions import NotFoundError, RemoteServerError
-from txlib.http import http_requests
-from txlib.api import (
-    project,
-    resources,
-    translations,
-    statistics,
-)
+from txlib.http import auth, http_requests
+from txlib.http.exceptions import NoResponseError, NotFoundError
+
+import client
+import metrics
+from conf import settings
 
 LOCALES = ('fr_CA', 'fr_FR', 'es_ES')
 
@@ -16,31 +15,150 @@ UNTRANSLATED_LOCALES = ('en', 'en-us',)
 DEFAULT_SOURCE_LANGUAGE = 'en_US'
 DEFAULT_I18N_TYPE = 'HTML'
 
+# the txlib registry is process-global, so the pooled handler installed
+# in it is shared by every Tx
+_registry_lock = threading.Lock()
+_http_handler = None
+
+
+class PooledHttpRequest(http_requests.HttpRequest):
+    """txlib HTTP handler which sends requests through a PooledSession.
+
+    The stock handler calls requests.request() for every call, which
+    opens a new connection (and TLS handshake) each time.
+    """
+
+    def __init__(self, hostname, session, **kwargs):
+
+        super(PooledHttpRequest, self).__init__(hostname, **kwargs)
+
+        self._session = session
+
+    def _make_request(self, method, path, data=None, **kwargs):
+
+        url = self._construct_full_url(path)
+        self._auth_info.populate_request_data(kwargs)
+        res = self._session.request(method, url, data=data, **kwargs)
+
+        if res.ok:
+            return res.content
+
+        if hasattr(res, 'content'):
+            raise self._exception_for(res.status_code)(
+                res.content, http_code=res.status_code
+            )
+
+        raise NoResponseError("No response from the URL %s" % (url,))
+
+
+def make_http_handler(session, host=None, username=None, password=None):
+    """Return a txlib HTTP handler for Transifex which uses session.
+
+    The host and credentials default to the TRANSIFEX_HOST,
+    TRANSIFEX_USERNAME and TRANSIFEX_PASSWORD settings.
+    """
+
+    return PooledHttpRequest(
+        host or settings.TRANSIFEX_HOST,
+        session,
+        auth=auth.BasicAuth(
+            username or settings.TRANSIFEX_USERNAME,
+            password or settings.TRANSIFEX_PASSWORD,
+        ),
+    )
+
+
+def instance_http_handler(prefix, label=None):
+    """Return an HTTP handler with a connection pool of its own.
+
+    It is configured by the settings <prefix>_TRANSIFEX_HOST, _USERNAME,
+    _PASSWORD, _POOL_SIZE and _TIMEOUT (ie TUTORIALS_TRANSIFEX_HOST);
+    any which aren't set fall back to the process-wide values. label is
+    passed on to client.new_session().
+    """
+
+    def setting(name):
+        return settings.get('%s_TRANSIFEX_%s' % (prefix.upper(), name))
+
+    options = {}
+    if setting('POOL_SIZE'):
+        options['pool_size'] = int(setting('POOL_SIZE'))
+    if setting('TIMEOUT'):
+        options['timeout'] = float(setting('TIMEOUT'))
+
+    return make_http_handler(
+        client.new_session('transifex', label=label, **options),
+        host=setting('HOST'),
+        username=setting('USERNAME'),
+        password=setting('PASSWORD'),
+    )
+
+
 class Tx(object):
+    """Client for the Transifex projects of one kind of content.
 
-    def __init__(self, project_slug_prefix):
+    Requests are made through http_handler, a txlib HTTP handler. If
+    none is given, the process-wide handler installed in the txlib
+    registry is used; otherwise this Tx doesn't touch the (global)
+    registry at all. Transifex objects are returned as the dicts of the
+    API v2 responses.
+    """
+
+    def __init__(self, project_slug_prefix, translation_cache=None,
+                 http_handler=None):
 
         self.__project_slug_prefix = project_slug_prefix
 
-        self.setup_registry()
+        # a cache.TranslationCache, consulted before downloading
+        self.translation_cache = translation_cache
+
+        # run-scoped statistics caches, keyed by project slug and
+        # (project slug, resource slug) respectively
+        self._stats_lock = threading.Lock()
+        self._project_stats = {}
+        self._resource_stats = {}
+
+        # run-scoped project and resource indexes, keyed by project slug;
+        # kept up to date as resources are created and deleted
+        self._index_lock = threading.RLock()
+        self._projects = {}
+        self._resource_index = {}
+
+        self.http = http_handler or self.setup_registry()
 
     def projects(self):
         """Yield (project, lang) tuples for all help center projects."""
 
-        project.Project._http.get(
-            project.Project._construct_path_to_collection()
-        )
+        self.http.get('/api/2/projects/')
 
+    @metrics.timed('tx.get_project')
     def get_project(self, locale, **kwargs):
+        """Return the project (a dict) for locale, creating it if needed.
+
+        The project is looked up at most once per Tx.
+        """
+
+        project_slug = self.get_project_slug(locale)
+
+        with self._index_lock:
+            if project_slug not in self._projects:
+                self._projects[project_slug] = self._get_or_create_project(
+                    locale, **kwargs
+                )
+
+            return self._projects[project_slug]
+
+    def _get_or_create_project(self, locale, **kwargs):
+
+        project_slug = self.get_project_slug(locale)
 
         try:
-            locale_project = project.Project.get(slug=self.get_project_slug(locale))
+            locale_project = self.http.get(
+                '/api/2/project/%s/?details' % (project_slug,)
+            )
 
         except NotFoundError:
 
-            locale_project = project.Project(
-                slug=self.get_project_slug(locale),
-            )
             defaults = {
                 'name': 'Help Center (%s)' % (locale, ),
                 'description': 'Help Center pages to translate to %s' % (
@@ -55,11 +173,11 @@ class Tx(object):
                 dict((k,v) for k,v in kwargs.iteritems() if k in valid_keys)
             )
 
-            for k,v in defaults.iteritems():
-                setattr(locale_project, k, v)
-
-            locale_project.save()
+            locale_project = dict(defaults, slug=project_slug)
+            self.http.post('/api/2/projects/', json.dumps(locale_project))
 
+            # a new project has no resources yet
+            self._resource_index[project_slug] = {}
 
         return locale_project
 
@@ -68,82 +186,246 @@ class Tx(object):
         return "%s-%s" % (self.__project_slug_prefix, locale)
 
     def setup_registry(self):
+        """Install the pooled HTTP handler in the txlib registry.
 
-        registry.registry.setup(
-            {
-                'http_handler': http_requests.HttpRequest(
-                    settings.TRANSIFEX_HOST,
-                    auth=auth.BasicAuth(
-                        settings.TRANSIFEX_USERNAME,
-                        settings.TRANSIFEX_PASSWORD,
-                    ),
-                ),
-            },
-        )
+        The handler, and its keep-alive connections, are created once
+        per process and shared by every Tx without a handler of its
+        own. Returns the handler.
+        """
+
+        global _http_handler
+
+        with _registry_lock:
+            if _http_handler is None:
+                _http_handler = make_http_handler(
+                    client.get_session('transifex'),
+                )
+
+            registry.registry.setup({'http_handler': _http_handler})
+
+        return _http_handler
 
+    @metrics.timed('tx.create_resource')
     def create_resource(self, slug, lang, name, content,
                         i18n_type=None,
                         project_slug=None):
 
-        resource = resources.Resource(
-            project_slug=project_slug or self.get_project_slug(lang),
-            slug=str(slug),
+        resource = {
+            'slug': str(slug),
+            'name': name,
+            'i18n_type': i18n_type or DEFAULT_I18N_TYPE,
+        }
+
+        self.http.post(
+            '/api/2/project/%s/resources/' % (
+                project_slug or self.get_project_slug(lang),
+            ),
+            json.dumps(dict(resource, content=content)),
         )
 
-        resource.name = name
-        resource.i18n_type = i18n_type or DEFAULT_I18N_TYPE
-        resource.content = content
-        resource.save()
+        index = self.resource_index(lang, project_slug=project_slug)
+        with self._index_lock:
+            index[str(slug)] = resource
+
+        return resource
+
+    @metrics.timed('tx.update_resource')
+    def update_resource(self, slug, lang, name, content, project_slug=None):
+        """Update the name and source content of an existing Resource.
+
+        The name is only sent when it differs from the indexed one.
+        """
+
+        project_slug = project_slug or self.get_project_slug(lang)
+        path = '/api/2/project/%s/resource/%s/' % (project_slug, slug)
+
+        self.http.put(path + 'content/', json.dumps({'content': content}))
+
+        resource = self.resource_exists(slug, lang, project_slug=project_slug)
+        if resource.get('name') != name:
+            self.http.put(path, json.dumps({'name': name}))
+            with self._index_lock:
+                resource['name'] = name
 
         return resource
 
+    @metrics.timed('tx.create_or_update_resource')
     def create_or_update_resource(self, slug, locale, name, content,
                                   i18n_type=None,
                                   project_slug=None):
 
-        resource = self.resource_exists(slug, locale, project_slug=project_slug)
-        if not resource:
+        if not self.resource_exists(slug, locale, project_slug=project_slug):
             return self.create_resource(slug, locale, name, content,
                                         i18n_type=i18n_type,
                                         project_slug=project_slug)
-        resource.name = name
-        resource.content = content
-        resource.save()
 
-        return resource
+        return self.update_resource(slug, locale, name, content,
+                                    project_slug=project_slug)
 
-    def resource_statistics(self, slug, locale):
+    @metrics.timed('tx.resource_statistics')
+    def resource_statistics(self, slug, locale, project_slug=None):
+        """Return a dict of language to the statistics of slug, or None."""
 
         try:
-            stats = statistics.Statistics.get(
-                project_slug = self.get_project_slug(locale),
-                resource_slug = slug,
+            stats = self.http.get(
+                '/api/2/project/%s/resource/%s/stats/' % (
+                    project_slug or self.get_project_slug(locale), slug,
+                )
             )
         except NotFoundError:
             stats = None
 
         return stats
 
+    @metrics.timed('tx.project_statistics')
+    def project_statistics(self, locale):
+        """Return the project-wide statistics for locale.
+
+        The statistics are fetched with a single request the first time
+        and cached for the lifetime of this Tx. Returns None if the
+        project or language does not exist in Transifex.
+        """
+
+        project_slug = self.get_project_slug(locale)
+
+        with self._stats_lock:
+            if project_slug in self._project_stats:
+                return self._project_stats[project_slug]
+
+        try:
+            stats = self.http.get(
+                '/api/2/project/%s/language/%s/?details' % (
+                    project_slug, locale,
+                )
+            )
+        except NotFoundError:
+            stats = None
+
+        with self._stats_lock:
+            self._project_stats[project_slug] = stats
+
+        return stats
+
+    @metrics.timed('tx.resource_completed')
+    def resource_completed(self, slug, locale):
+        """Return the completed percentage of slug in locale, ie '100%'.
+
+        When every segment in the locale's project is translated this is
+        answered from the cached project statistics, without a request
+        per resource. Otherwise the resource statistics are fetched once
+        and cached. Returns None if there is no translation.
+        """
+
+        project_stats = self.project_statistics(locale)
+        if project_stats is None:
+            return None
+
+        if int(project_stats.get('untranslated_segments', 1)) == 0:
+            return '100%'
+
+        stats = self.resource_language_statistics(slug, locale)
+        return stats and stats.get('completed')
+
+    def resource_language_statistics(self, slug, locale):
+        """Return the statistics of slug in locale, or None.
+
+        The statistics are fetched once and cached for the lifetime of
+        this Tx.
+        """
+
+        key = (self.get_project_slug(locale), slug)
+        with self._stats_lock:
+            if key in self._resource_stats:
+                return self._resource_stats[key]
+
+        try:
+            stats = self.http.get(
+                '/api/2/project/%s/resource/%s/stats/%s/' % (
+                    key[0], slug, locale,
+                )
+            )
+        except NotFoundError:
+            stats = None
+
+        with self._stats_lock:
+            self._resource_stats[key] = stats
+
+        return stats
+
+    @metrics.timed('tx.delete_resource')
     def delete_resource(self, slug, locale):
-        resource = self.resource_exists(slug, locale)
-        if resource:
-            resource.delete()
+        if self.resource_exists(slug, locale):
+            project_slug = self.get_project_slug(locale)
+            self.http.delete(
+                '/api/2/project/%s/resource/%s/' % (project_slug, slug)
+            )
+
+            with self._index_lock:
+                self._resource_index[project_slug].pop(str(slug), None)
 
-    def translation_exists(self, slug, lang):
-        """Return True if the translation exists for this slug."""
+    @metrics.timed('tx.translation_exists')
+    def translation_exists(self, slug, lang, project_slug=None):
+        """Return the translation of slug in lang, or False if missing.
+
+        The translation is a dict with the translated document as its
+        content. Server errors are retried by the HTTP handler and
+        raised if they persist, rather than being mistaken for a missing
+        translation.
+        """
 
         try:
-            return translations.Translation.get(
-                project_slug=self.get_project_slug(lang),
-                slug=slug,
-                lang=lang,
+            return self.http.get(
+                '/api/2/project/%s/resource/%s/translation/%s/' % (
+                    project_slug or self.get_project_slug(lang), slug, lang,
+                )
             )
 
-        except (NotFoundError, RemoteServerError):
+        except NotFoundError:
             pass
 
         return False
 
+    @metrics.timed('tx.translation_content')
+    def translation_content(self, slug, lang, source_revision=None):
+        """Return the translated content of slug in lang, or None.
+
+        With a translation cache and a source_revision (such as the hash
+        of the last source document pushed), the cached content is keyed
+        on both the translation's last update, from the resource
+        statistics, and source_revision: a markup-only change to the
+        source changes the translated document without updating the
+        translation. It is only downloaded if that revision isn't there.
+        """
+
+        project_slug = self.get_project_slug(lang)
+
+        revision = None
+        if self.translation_cache is not None and source_revision:
+            stats = self.resource_language_statistics(slug, lang)
+            last_update = stats and stats.get('last_update')
+            if last_update:
+                revision = '%s %s' % (last_update, source_revision)
+
+        if revision:
+            content = self.translation_cache.get(
+                project_slug, slug, lang, revision,
+            )
+            if content is not None:
+                return content
+
+        translation = self.translation_exists(slug, lang)
+        if not translation:
+            return None
+
+        content = translation['content']
+        if revision:
+            self.translation_cache.set(
+                project_slug, slug, lang, revision, content,
+            )
+
+        return content
+
+    @metrics.timed('tx.list_resources')
     def list_resources(self, lang):
         """Return a sequence of resources for a given lang.
 
@@ -151,11 +433,40 @@ class Tx(object):
         source_language_code and the category.
         """
 
-        return registry.registry.http_handler.get(
-            '/api/2/project/%s/resources/' % (
-                self.get_project_slug(lang),)
+        return self._list_project_resources(self.get_project_slug(lang))
+
+    def _list_project_resources(self, project_slug):
+
+        resource_list = self.http.get(
+            '/api/2/project/%s/resources/' % (project_slug,)
         )
 
+        with self._index_lock:
+            self._resource_index[project_slug] = dict(
+                (r['slug'], r) for r in resource_list
+            )
+
+        return resource_list
+
+    def resource_index(self, lang, project_slug=None):
+        """Return a dict of resource slug to resource info for lang.
+
+        The index is built from a single list request per project and
+        maintained locally afterwards. A missing project has an empty
+        index.
+        """
+
+        project_slug = project_slug or self.get_project_slug(lang)
+
+        with self._index_lock:
+            if project_slug not in self._resource_index:
+                try:
+                    self._list_project_resources(project_slug)
+                except NotFoundError:
+                    self._resource_index[project_slug] = {}
+
+            return self._resource_index[project_slug]
+
     def resources(self, lang, slug):
         """Generate a list of Resources in the Project.
 
@@ -164,28 +475,24 @@ class Tx(object):
 
         """
 
-        resource = resources.Resource.get(
-            project_slug=self.get_project_slug(lang),
-            slug=slug,
+        return self.http.get(
+            '/api/2/project/%s/resource/%s/?details' % (
+                self.get_project_slug(lang), slug,
+            )
         )
 
-        return resource
-
+    @metrics.timed('tx.resource_exists')
     def resource_exists(self, slug, locale, project_slug=None):
-        """Return True if a Resource with the given slug exists in locale."""
-
-        try:
-            resource = resources.Resource.get(
-                project_slug=project_slug or self.get_project_slug(locale),
-                slug=slug,
-            )
+        """Return the indexed resource info if slug exists in locale.
 
-            return resource
+        Answered from the resource index; returns None if the resource
+        does not exist.
+        """
 
-        except NotFoundError:
-            pass
+        index = self.resource_index(locale, project_slug=project_slug)
 
-        return None
+        with self._index_lock:
+            return index.get(str(slug))
 
     ## def completed_translations(self, slug):
     ##     """Generate (lang, translation) tuples for the given resource slug."""
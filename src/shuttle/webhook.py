@@ -0,0 +1,369 @@
+"""HTTP listener which syncs single units when Desk or Transifex notify us.
+
+Desk should POST JSON to /desk when an article or topic changes:
+
+    {"type": "article", "id": 123, "locale": "fr"}
+
+locale is optional, and omitting it pushes every enabled locale of the
+article. Transifex webhooks POST (form encoded or JSON) to /transifex
+with the project, resource and language which changed; these pull that
+translation into Desk.
+
+Bursts of notifications for the same unit are coalesced: a unit is
+synced once no further notifications for it have arrived for the
+debounce window, or at most max_wait seconds after the first.
+
+Every notification must be authenticated. Desk (or any other sender)
+passes the shared token as the X-Shuttle-Token header or the token
+query parameter, ie /desk?token=...; Transifex notifications may
+instead be signed with the webhook secret configured in Transifex.
+"""
+
+import BaseHTTPServer
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import urlparse
+
+import state
+from conf import settings
+from workers import WorkerPool
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_DEBOUNCE = 5.0
+DEFAULT_MAX_WAIT = 60.0
+
+TOKEN_HEADER = 'X-Shuttle-Token'
+
+# DeskTopics.TOPIC_STRINGS_SLUG
+TOPIC_STRINGS_SLUG = 'desk-topics'
+
+
+def desk_units(payload):
+    """Return the (handler, direction, slug, locale) units for a Desk change."""
+
+    object_type = payload.get('type')
+    if object_type == 'article':
+        return [('tutorials', state.PUSH, str(payload['id']),
+                 payload.get('locale') or None)]
+
+    if object_type == 'topic':
+        # topic names are pushed as a single resource
+        return [('topics', state.PUSH, TOPIC_STRINGS_SLUG, None)]
+
+    raise ValueError('Unknown Desk object type %r.' % (object_type,))
+
+
+def transifex_units(payload):
+    """Return the (handler, direction, slug, locale) units for a Tx change.
+
+    Notifications of partially translated resources are ignored.
+    """
+
+    percent = payload.get('percent')
+    if percent is not None and int(percent) < 100:
+        return []
+
+    project = payload['project']
+    resource = payload['resource']
+    language = payload['language']
+
+    if project == settings.TOPICS_PROJECT_SLUG:
+        return [('topics', state.PULL, resource, language)]
+
+    if project.startswith('%s-' % (settings.TUTORIALS_PROJECT_SLUG,)):
+        return [('tutorials', state.PULL, resource, language)]
+
+    raise ValueError('Unknown Transifex project %r.' % (project,))
+
+
+PARSERS = {
+    '/desk': desk_units,
+    '/transifex': transifex_units,
+}
+
+
+def _equal(a, b):
+
+    compare = getattr(hmac, 'compare_digest', None)
+    if compare is not None:
+        return compare(a, b)
+
+    return len(a) == len(b) and sum(ord(x) ^ ord(y) for x, y in zip(a, b)) == 0
+
+
+def transifex_signed(secret, headers, body):
+    """Return True if headers carry a valid Transifex signature of body.
+
+    Both the HMAC-SHA256 X-TX-Signature-V2 header, signed over the
+    method, URL, date and MD5 of the body, and the legacy HMAC-SHA1
+    X-TX-Signature of the body alone are accepted.
+    """
+
+    signature = headers.get('X-TX-Signature-V2')
+    if signature:
+        message = '\n'.join([
+            'POST',
+            headers.get('X-TX-Url', ''),
+            headers.get('Date', ''),
+            hashlib.md5(body).hexdigest(),
+        ])
+        expected = hmac.new(secret, message, hashlib.sha256).digest()
+        return _equal(base64.b64encode(expected), signature)
+
+    signature = headers.get('X-TX-Signature')
+    if signature:
+        expected = hmac.new(secret, body, hashlib.sha1).digest()
+        return _equal(base64.b64encode(expected), signature)
+
+    return False
+
+
+class Debouncer(object):
+    """Coalesce repeated events for the same key.
+
+    Each add() of a key (re)starts its window; once a key has seen no
+    events for window seconds, or max_wait seconds have passed since
+    its first pending event, it is passed to dispatch along with any
+    other keys due at the same time, on the debouncer's thread.
+    """
+
+    def __init__(self, window, dispatch, log=None,
+                 max_wait=DEFAULT_MAX_WAIT):
+
+        self.window = window
+        self.max_wait = max(window, max_wait)
+        self.dispatch = dispatch
+        self.log = log or logging.getLogger(__name__)
+        self.dispatched = 0
+
+        self._lock = threading.Lock()
+        self._due = {}
+        self._deadlines = {}
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, key):
+
+        now = time.time()
+
+        with self._lock:
+            deadline = self._deadlines.setdefault(key, now + self.max_wait)
+            self._due[key] = min(now + self.window, deadline)
+
+        self._wake.set()
+
+    def pending(self):
+
+        with self._lock:
+            return len(self._due)
+
+    def take_due(self, now=None):
+        """Remove and return the keys whose window has passed."""
+
+        now = time.time() if now is None else now
+
+        with self._lock:
+            due = sorted(key for key, at in self._due.items() if at <= now)
+            for key in due:
+                del self._due[key]
+                del self._deadlines[key]
+
+            return due
+
+    def start(self):
+
+        self._thread = threading.Thread(
+            target=self._run, name='shuttle-debouncer',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop, dispatching any keys still waiting for their window."""
+
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        remaining = self.take_due(now=float('inf'))
+        if remaining:
+            self._dispatch(remaining)
+
+    def _run(self):
+
+        while not self._stopped:
+            due = self.take_due()
+            if due:
+                self._dispatch(due)
+
+            with self._lock:
+                next_due = min(self._due.values()) if self._due else None
+
+            self._wake.clear()
+            if next_due is None:
+                self._wake.wait(1)
+            else:
+                self._wake.wait(max(0, next_due - time.time()))
+
+    def _dispatch(self, keys):
+
+        try:
+            self.dispatch(keys)
+        except Exception:
+            self.log.exception('Error dispatching %d unit(s).', len(keys))
+
+        self.dispatched += len(keys)
+
+
+class WebhookListener(object):
+    """Accept change notifications and sync the units they name.
+
+    handlers is a dict of handler name to handler; notifications for
+    other handlers are accepted but ignored. Each batch of due units
+    runs on a WorkerPool of workers threads, with a fresh Desk cache
+    per handler.
+
+    Notifications are rejected unless they carry token, or for
+    /transifex are signed with tx_secret; at least one is required.
+    """
+
+    def __init__(self, handlers, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 debounce=DEFAULT_DEBOUNCE, workers=1, log=None,
+                 token=None, tx_secret=None, max_wait=DEFAULT_MAX_WAIT):
+
+        if not (token or tx_secret):
+            raise ValueError('A webhook token or Transifex secret is '
+                             'required.')
+
+        self.handlers = handlers
+        self.workers = workers
+        self.token = token and str(token)
+        self.tx_secret = tx_secret and str(tx_secret)
+        self.log = log or logging.getLogger(__name__)
+        self.debouncer = Debouncer(debounce, self.dispatch, self.log,
+                                   max_wait=max_wait)
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), WebhookRequest)
+        self.server.listener = self
+
+    def authorized(self, path, query, headers, body):
+        """Return True if a notification may be acted on."""
+
+        if self.token:
+            token = (headers.get(TOKEN_HEADER) or
+                     dict(urlparse.parse_qsl(query)).get('token'))
+            if token and _equal(token, self.token):
+                return True
+
+        if self.tx_secret and path == '/transifex':
+            return transifex_signed(self.tx_secret, headers, body)
+
+        return False
+
+    def notify(self, path, payload):
+        """Queue the units named by a notification; return them."""
+
+        units = [
+            unit for unit in PARSERS[path](payload)
+            if unit[0] in self.handlers
+        ]
+        for unit in units:
+            self.debouncer.add(unit)
+
+        return units
+
+    def dispatch(self, units):
+        """Sync units, a list of (handler, direction, slug, locale)."""
+
+        for name in set(unit[0] for unit in units):
+            handler = self.handlers[name]
+            handler.desk = handler.desk.fresh()
+
+        pool = WorkerPool(self.workers, self.log)
+        for name, direction, slug, locale in units:
+            pool.submit(
+                '%s %s of %s for %s' % (name, direction, slug, locale or 'all'),
+                self.handlers[name].sync_unit, direction, slug, locale,
+            )
+
+        return pool.join()
+
+    def serve_forever(self):
+        """Serve notifications until interrupted with ^C."""
+
+        self.log.info('Listening for notifications on %s:%d.',
+                      *self.server.server_address)
+        self.debouncer.start()
+
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self.log.info('Stopping listener.')
+
+        self.server.server_close()
+        self.debouncer.stop()
+
+
+class WebhookRequest(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path != '/status':
+            return self.respond(404, {'error': 'Not found.'})
+
+        debouncer = self.server.listener.debouncer
+        self.respond(200, {
+            'pending': debouncer.pending(),
+            'dispatched': debouncer.dispatched,
+        })
+
+    def do_POST(self):
+
+        url = urlparse.urlparse(self.path)
+        path = url.path.rstrip('/')
+        if path not in PARSERS:
+            return self.respond(404, {'error': 'Not found.'})
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if not self.server.listener.authorized(path, url.query,
+                                               self.headers, body):
+            return self.respond(403, {'error': 'Not authorized.'})
+
+        try:
+            if self.headers.get('Content-Type', '').startswith(
+                    'application/x-www-form-urlencoded'):
+                payload = dict(urlparse.parse_qsl(body))
+            else:
+                payload = json.loads(body)
+
+            units = self.server.listener.notify(path, payload)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self.respond(400, {'error': str(e)})
+
+        self.respond(202, {'units': len(units)})
+
+    def respond(self, code, result):
+
+        content = json.dumps(result)
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+
+        self.server.listener.log.debug('%s - %s', self.address_string(),
+                                       format % args)
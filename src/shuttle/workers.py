@@ -0,0 +1,136 @@
+"""Bounded worker pool for running independent sync units concurrently."""
+
+import logging
+import threading
+import time
+from Queue import Queue
+
+
+class WorkerPool(object):
+    """Run submitted units on a fixed number of worker threads.
+
+    Each unit is a callable with a human readable label. Exceptions
+    raised by a unit are logged against that label and collected; they
+    do not stop the remaining units from running.
+
+    With a single worker, units run inline in the submitting thread,
+    which preserves the original sequential behavior. A pool runs a
+    single batch: once join() returns, further units run inline.
+    """
+
+    def __init__(self, workers=1, log=None):
+
+        self.workers = max(1, workers or 1)
+        self.log = log or logging.getLogger(__name__)
+        self.failures = []
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+
+        if self.workers > 1:
+            # bound the queue so producers can't race far ahead of the
+            # workers and hold every unit's inputs in memory
+            self._queue = Queue(self.workers * 2)
+
+            for n in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    name='shuttle-worker-%d' % (n,),
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, label, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs) as the unit named label."""
+
+        if self._queue is None:
+            self._run(label, func, args, kwargs)
+        else:
+            self._queue.put((label, func, args, kwargs))
+
+    def join(self):
+        """Wait for all submitted units; return the failed unit labels."""
+
+        if self._queue is not None:
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+            self._queue = None
+            self._threads = []
+
+        if self.failures:
+            self.log.error('%d unit(s) failed: %s',
+                           len(self.failures),
+                           ', '.join(self.failures),
+            )
+
+        return self.failures
+
+    def _work(self):
+
+        while True:
+            unit = self._queue.get()
+            if unit is None:
+                return
+
+            label, func, args, kwargs = unit
+            self._run(label, func, args, kwargs)
+
+    def _run(self, label, func, args, kwargs):
+
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            self.log.exception('Error processing %s.', label)
+            with self._lock:
+                self.failures.append(label)
+
+
+def run_ordered(tasks, dependencies=None, log=None):
+    """Run tasks concurrently, each after the tasks it depends on.
+
+    tasks is a dict of name to callable, and dependencies a dict of
+    name to the names which must finish first; dependencies which are
+    not in tasks are ignored. A task runs even if one it depends on
+    failed. Returns a dict of name to (seconds, failed).
+    """
+
+    log = log or logging.getLogger(__name__)
+    dependencies = dependencies or {}
+
+    finished = dict((name, threading.Event()) for name in tasks)
+    results = {}
+
+    def run(name):
+
+        for dependency in dependencies.get(name, ()):
+            if dependency in finished:
+                finished[dependency].wait()
+
+        started = time.time()
+        failed = False
+        try:
+            tasks[name]()
+        except Exception:
+            log.exception('Error running %s.', name)
+            failed = True
+        finally:
+            results[name] = (time.time() - started, failed)
+            finished[name].set()
+
+    threads = []
+    for name in sorted(tasks):
+        thread = threading.Thread(target=run, args=(name,),
+                                  name='shuttle-%s' % (name,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return results